@@ -6,6 +6,7 @@ SQLite база данных для токенов, платежей и проф
 
 from __future__ import annotations
 
+import atexit
 import sqlite3
 import os
 import logging
@@ -15,27 +16,49 @@ from typing import Optional, Dict, Any
 from contextlib import contextmanager
 from pathlib import Path
 
+from pers.db_sync import mark_db_dirty
+
 logger = logging.getLogger(__name__)
 
 # Путь к БД в корне проекта
 BASE_DIR = Path(__file__).parent.parent
 DB_PATH = BASE_DIR / "users.db"
 
-# Настройки connection pool
-POOL_SIZE = 5  # Количество соединений в пуле
+# Настройки connection pool.
+# WAL допускает одного писателя и много читателей, поэтому пул разделен:
+# пишущий пул из одного соединения (писатели в SQLite все равно
+# сериализуются) и пул read-only читателей, которые не ждут его блокировку.
+POOL_SIZE = 1  # Количество пишущих соединений в пуле
+READ_POOL_SIZE = max(2, os.cpu_count() or 2)  # Количество читающих соединений
 POOL_TIMEOUT = 10.0  # Таймаут ожидания соединения из пула
 
-# Thread-safe пул соединений
+# Thread-safe пулы соединений
 _connection_pool: Optional[queue.Queue] = None
 _pool_lock = threading.Lock()
 _pool_initialized = False
 
+_read_pool: Optional[queue.Queue] = None
+_read_pool_lock = threading.Lock()
+_read_pool_initialized = False
+
+# Поколение пулов: close_all_connections инкрементирует счетчик, и соединение,
+# взятое до закрытия, по возврату видит смену поколения и закрывается само
+# вместо возврата в уже замененный пул
+_pool_generation = 0
+
 
 def _create_connection() -> sqlite3.Connection:
     """Создает новое соединение с БД с оптимальными настройками."""
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=10.0)
+    # cached_statements выше дефолтных 128: разнородных запросов к users.db
+    # много, а промах кэша — это повторный разбор SQL
+    conn = sqlite3.connect(
+        DB_PATH, check_same_thread=False, timeout=10.0, cached_statements=256
+    )
     conn.row_factory = sqlite3.Row
-    
+    # Управляем транзакциями сами (BEGIN IMMEDIATE в get_db_connection),
+    # без неявных BEGIN от модуля sqlite3
+    conn.isolation_level = None
+
     # Оптимизации для производительности
     conn.execute("PRAGMA journal_mode=WAL")  # WAL режим для параллельных операций
     conn.execute("PRAGMA synchronous=NORMAL")  # Баланс между скоростью и надежностью
@@ -46,6 +69,49 @@ def _create_connection() -> sqlite3.Connection:
     return conn
 
 
+def _create_read_connection() -> sqlite3.Connection:
+    """Создает read-only соединение (URI mode=ro + query_only)."""
+    conn = sqlite3.connect(
+        f"file:{DB_PATH}?mode=ro",
+        uri=True,
+        check_same_thread=False,
+        timeout=10.0,
+        cached_statements=256,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+
+def _init_read_pool() -> None:
+    """Инициализирует пул читающих соединений."""
+    global _read_pool, _read_pool_initialized
+
+    if _read_pool_initialized:
+        return
+
+    with _read_pool_lock:
+        if _read_pool_initialized:
+            return
+
+        # mode=ro требует существующего файла БД — создаем схему через
+        # пишущее соединение (no-op после первого вызова)
+        init_database()
+
+        _read_pool = queue.Queue(maxsize=READ_POOL_SIZE)
+        for _ in range(READ_POOL_SIZE):
+            try:
+                _read_pool.put(_create_read_connection())
+            except Exception as e:
+                logger.error(f"Ошибка при создании читающего соединения: {e}")
+
+        _read_pool_initialized = True
+        logger.info(f"Инициализирован read-only pool размером {READ_POOL_SIZE}")
+
+
 def _init_pool() -> None:
     """Инициализирует пул соединений."""
     global _connection_pool, _pool_initialized
@@ -71,38 +137,49 @@ def _init_pool() -> None:
         logger.info(f"Инициализирован connection pool размером {POOL_SIZE}")
 
 
+def _drain_pool(pool: Optional[queue.Queue]) -> int:
+    """Закрывает все соединения из уже отцепленной очереди."""
+    if pool is None:
+        return 0
+    closed = 0
+    while True:
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            conn.close()
+            closed += 1
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии соединения: {e}")
+    return closed
+
+
 def close_all_connections() -> None:
     """
-    Закрывает все соединения из пула.
+    Закрывает все соединения из пулов.
     Используется перед загрузкой БД в облако для применения WAL изменений.
     """
-    global _connection_pool, _pool_initialized
-    
-    if not _pool_initialized or not _connection_pool:
-        return
-    
+    global _connection_pool, _pool_initialized, _pool_generation
+    global _read_pool, _read_pool_initialized
+
+    # Под локами только отцепляем пулы и двигаем поколение; сами close
+    # выполняются ниже без локов, не задерживая параллельные checkout'ы
     with _pool_lock:
-        if not _connection_pool:
-            return
-        
-        closed_count = 0
-        # Закрываем все соединения из пула
-        while True:
-            try:
-                conn = _connection_pool.get_nowait()
-                try:
-                    conn.close()
-                    closed_count += 1
-                except Exception as e:
-                    logger.warning(f"Ошибка при закрытии соединения: {e}")
-            except queue.Empty:
-                break
-        
+        pool = _connection_pool
         _connection_pool = None
         _pool_initialized = False
-        
-        if closed_count > 0:
-            logger.info(f"Закрыто {closed_count} соединений из пула")
+        _pool_generation += 1
+
+    with _read_pool_lock:
+        read_pool = _read_pool
+        _read_pool = None
+        _read_pool_initialized = False
+
+    # queue сама потокобезопасна, а в отцепленные очереди уже никто не пишет
+    closed_count = _drain_pool(pool) + _drain_pool(read_pool)
+    if closed_count > 0:
+        logger.info(f"Закрыто {closed_count} соединений из пулов users.db")
 
 
 @contextmanager
@@ -116,6 +193,7 @@ def get_db_connection(timeout: float = 10.0):
     """
     _init_pool()
     
+    generation = _pool_generation
     conn = None
     try:
         # Получаем соединение из пула
@@ -126,24 +204,20 @@ def get_db_connection(timeout: float = 10.0):
             logger.warning("Пул соединений пуст, создается временное соединение")
             conn = _create_connection()
         
-        # Проверяем, что соединение живое
-        try:
-            conn.execute("SELECT 1").fetchone()
-        except sqlite3.Error:
-            # Соединение мертво, создаем новое
-            logger.warning("Соединение из пула мертво, создается новое")
-            try:
-                conn.close()
-            except:
-                pass
-            conn = _create_connection()
-        
+        changes_before = conn.total_changes
+        # Берем write-lock сразу: deferred-транзакция при апгрейде блокировки
+        # на первой записи может словить SQLITE_BUSY, IMMEDIATE — нет
+        conn.execute("BEGIN IMMEDIATE")
         yield conn
         # Явно делаем commit перед возвратом соединения в пул
         # Это критично для сохранения изменений в WAL режиме
-        # В WAL режиме commit должен быть явным для гарантии записи
+        # (no-op, если вызывающий уже закоммитил внутри блока)
         try:
             conn.commit()
+            # Рост total_changes означает фактическую запись — помечаем БД
+            # для следующей синхронизации в облако
+            if conn.total_changes != changes_before:
+                mark_db_dirty("users.db")
         except Exception as commit_error:
             logger.error(f"Ошибка при commit: {commit_error}")
             if conn:
@@ -159,23 +233,93 @@ def get_db_connection(timeout: float = 10.0):
                 conn.rollback()
             except Exception:
                 pass
+            # Health-check на каждый checkout убран: локальный SQLite-файл
+            # соединения "тихо" не теряет. Редкое мертвое соединение ловим
+            # здесь — закрываем и кладем в пул свежее вместо отравленного.
+            if isinstance(e, (sqlite3.OperationalError, sqlite3.ProgrammingError)):
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+                try:
+                    _connection_pool.put_nowait(_create_connection())
+                except Exception as repl_error:
+                    logger.warning(f"Не удалось заменить соединение в пуле: {repl_error}")
         logger.error(f"Ошибка БД: {e}")
         raise
     finally:
         if conn:
-            # Возвращаем соединение в пул или закрываем, если пул переполнен
-            try:
-                _connection_pool.put_nowait(conn)
-            except queue.Full:
-                # Пул переполнен, закрываем соединение
-                conn.close()
-            except Exception as e:
-                # Ошибка при возврате в пул, закрываем соединение
-                logger.warning(f"Ошибка при возврате соединения в пул: {e}")
+            pool = _connection_pool
+            if generation != _pool_generation or pool is None:
+                # Пул заменен (close_all_connections) пока соединение было
+                # в работе — закрываем, а не возвращаем в новый пул
                 try:
                     conn.close()
-                except:
+                except Exception:
                     pass
+            else:
+                # Возвращаем соединение в пул или закрываем, если пул переполнен
+                try:
+                    pool.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+                except Exception as e:
+                    logger.warning(f"Ошибка при возврате соединения в пул: {e}")
+                    try:
+                        conn.close()
+                    except:
+                        pass
+
+
+# Пишущий пул — это и есть get_db_connection; алиас для явных вызовов
+get_write_connection = get_db_connection
+
+
+@contextmanager
+def get_read_connection():
+    """
+    Контекстный менеджер для чистых чтений: read-only соединение из
+    отдельного пула. Читатели в WAL не конкурируют с писателем, нет
+    commit/rollback и dirty-трекинга.
+    """
+    _init_read_pool()
+
+    generation = _pool_generation
+    conn = None
+    try:
+        try:
+            conn = _read_pool.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            logger.warning("Read-пул пуст, создается временное соединение")
+            conn = _create_read_connection()
+
+        yield conn
+    except Exception as e:
+        logger.error(f"Ошибка БД (чтение): {e}")
+        raise
+    finally:
+        if conn:
+            pool = _read_pool
+            if generation != _pool_generation or pool is None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            else:
+                try:
+                    pool.put_nowait(conn)
+                except queue.Full:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                except Exception as e:
+                    logger.warning(f"Ошибка при возврате читающего соединения: {e}")
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
 
 
 def _load_database_from_cloud() -> None:
@@ -225,22 +369,34 @@ def _load_database_from_cloud() -> None:
             logger.warning(f"Не удалось загрузить users.db из облака: {e}")
 
 
+# Создание таблиц идемпотентно, но каждый вызов тратит checkout пула,
+# несколько statements и commit — выполняем тело один раз на процесс
+_init_db_lock = threading.Lock()
+_db_initialized = False
+
+
 def init_database() -> None:
     """
     Инициализирует базу данных и создает таблицы.
-    Вызывается автоматически при первом использовании.
+    Вызывается автоматически при первом использовании; повторные вызовы — no-op.
     """
+    global _db_initialized
+    if _db_initialized:
+        return
+    with _init_db_lock:
+        if _db_initialized:
+            return
+        _init_database_once()
+        _db_initialized = True
+
+
+def _init_database_once() -> None:
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
-        # Включаем WAL режим для параллельных операций
-        try:
-            cursor.execute("PRAGMA journal_mode=WAL")
-            result = cursor.fetchone()
-            logger.info(f"Режим журнала БД: {result[0] if result else 'unknown'}")
-        except Exception as e:
-            logger.warning(f"Не удалось установить WAL режим: {e}")
-        
+        # WAL режим уже включен в _create_connection; менять journal_mode
+        # внутри открытой транзакции (BEGIN IMMEDIATE) нельзя
+
         # Таблица токенов пользователей
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS token_balances (
@@ -263,6 +419,16 @@ def init_database() -> None:
             )
         """)
         
+        # Таблица обработанных заказов Tribute
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tribute_orders (
+                order_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                tokens INTEGER DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
         # Таблица профилей пользователей
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS user_profiles (
@@ -306,5 +472,16 @@ def init_database() -> None:
         logger.info("База данных users.db инициализирована")
 
 
-__all__ = ["get_db_connection", "init_database", "DB_PATH"]
+# Гарантированное закрытие при выходе процесса (идемпотентно; штатная
+# остановка уже вызывает close_all_connections перед выгрузкой в облако)
+atexit.register(close_all_connections)
+
+
+__all__ = [
+    "get_db_connection",
+    "get_read_connection",
+    "get_write_connection",
+    "init_database",
+    "DB_PATH",
+]
 
@@ -16,6 +16,26 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_START_TOKENS = int(os.getenv("SMS_DEFAULT_TOKENS", "20"))
 
+# Короткий кэш балансов: один клик может читать баланс несколько раз
+# (проверка перед чатом, показ профиля), кэш убирает повторные запросы к БД
+BALANCE_CACHE_TTL = 5  # секунды
+_balance_cache: dict[int, tuple[int, float]] = {}
+
+
+def get_balance_cached(user_id: int) -> int:
+    """Возвращает баланс из короткого кэша или из БД (см. BALANCE_CACHE_TTL)."""
+    cached = _balance_cache.get(user_id)
+    if cached is not None and (time.time() - cached[1]) < BALANCE_CACHE_TTL:
+        return cached[0]
+    balance = get_token_balance(user_id)
+    _balance_cache[user_id] = (balance, time.time())
+    return balance
+
+
+def invalidate_balance(user_id: int) -> None:
+    """Сбрасывает кэш баланса после начисления или списания токенов."""
+    _balance_cache.pop(user_id, None)
+
 
 def get_token_balance(user_id: int) -> int:
     """Получает баланс токенов пользователя."""
@@ -107,6 +127,7 @@ def set_token_balance(user_id: int, amount: int) -> int:
         )
         # Явно делаем commit для гарантии сохранения
         conn.commit()
+        invalidate_balance(user_id)
         logger.info(f"Установлен баланс {amount} токенов для user_id={user_id}")
         return amount
 
@@ -153,10 +174,52 @@ def add_tokens(user_id: int, amount: int) -> int:
         )
         # Явно делаем commit для гарантии сохранения
         conn.commit()
+        invalidate_balance(user_id)
         logger.info(f"Добавлено {amount} токенов пользователю {user_id}, баланс: {new_balance}")
         return new_balance
 
 
+def add_tokens_bulk(credits: list[tuple[int, int]]) -> dict[int, int]:
+    """
+    Начисляет токены группе пользователей одной транзакцией.
+
+    Принимает пары (user_id, amount) и возвращает новые балансы одним
+    SELECT — вместо пары UPDATE+SELECT с отдельным commit на пользователя.
+    """
+    if not credits:
+        return {}
+
+    init_database()
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        # Как и add_tokens: новый пользователь стартует с начального баланса
+        cursor.executemany(
+            """
+            INSERT INTO token_balances (user_id, tokens, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                tokens = MAX(0, CAST(tokens AS INTEGER) + ?),
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            [
+                (user_id, DEFAULT_START_TOKENS + amount, amount)
+                for user_id, amount in credits
+            ],
+        )
+        user_ids = [user_id for user_id, _ in credits]
+        placeholders = ",".join("?" * len(user_ids))
+        cursor.execute(
+            f"SELECT user_id, tokens FROM token_balances WHERE user_id IN ({placeholders})",
+            user_ids,
+        )
+        balances = {row["user_id"]: int(row["tokens"]) for row in cursor.fetchall()}
+
+    for user_id, _ in credits:
+        invalidate_balance(user_id)
+    return balances
+
+
 def consume_tokens(user_id: int, amount: int = 1) -> bool:
     """
     Списывает токены у пользователя.
@@ -165,10 +228,12 @@ def consume_tokens(user_id: int, amount: int = 1) -> bool:
     if amount <= 0:
         return True
     
-    # Проверяем безлимитный премиум статус (только тариф 4)
+    # Проверяем безлимитный премиум статус (только тариф 4).
+    # Импорт отложенный из-за цикла SMS <-> premium, но статус берется
+    # из кэша premium.cache, так что в БД запрос уходит не чаще раза в минуту
     try:
-        from premium.subscription import is_premium_unlimited
-        if is_premium_unlimited(user_id):
+        from premium.cache import get_premium_info
+        if get_premium_info(user_id).unlimited:
             # Безлимитный премиум - не списываем токены
             return True
     except Exception as e:
@@ -216,14 +281,18 @@ def consume_tokens(user_id: int, amount: int = 1) -> bool:
         )
         # Явно делаем commit для гарантии сохранения
         conn.commit()
+        invalidate_balance(user_id)
         logger.info(f"Списано {amount} токенов у user_id={user_id}, новый баланс: {new_balance}")
         return True
 
 
 __all__ = [
     "get_token_balance",
+    "get_balance_cached",
+    "invalidate_balance",
     "set_token_balance",
     "add_tokens",
+    "add_tokens_bulk",
     "consume_tokens",
 ]
 
@@ -10,6 +10,7 @@ from dataclasses import asdict, dataclass
 from typing import Any, Dict, List, Tuple
 
 from ai.model_router import send_chat_completion
+from premium.cache import get_premium_info
 # Используем роутер моделей с автоматическим fallback
 # from ai.gemini3pro_integration import send_chat_completion  # Теперь через роутер
 # from ai.gemini_integration import send_chat_completion  # Теперь через роутер
@@ -176,16 +177,12 @@ def start_persona_chat(
     Создаёт заготовку контекста для чата с указанным персонажем.
     Для премиум пользователей использует увеличенный лимит токенов.
     """
-    # Проверяем премиум статус для удлиненных ответов
-    try:
-        from premium.subscription import is_premium
-        if is_premium(user_id):
-            # Премиум пользователь - удлиненные ответы (в 2 раза больше)
-            max_tokens = max_tokens * 2
-            logger.debug(f"Премиум пользователь {user_id}: увеличен лимит токенов до {max_tokens}")
-    except Exception as e:
-        logger.warning(f"Ошибка при проверке премиум статуса для user_id={user_id}: {e}")
-        # Продолжаем с обычным лимитом при ошибке
+    # Проверяем премиум статус для удлиненных ответов (кэш сам обрабатывает
+    # ошибки и при сбое вернет неактивный статус - останется обычный лимит)
+    if get_premium_info(user_id).active:
+        # Премиум пользователь - удлиненные ответы (в 2 раза больше)
+        max_tokens = max_tokens * 2
+        logger.debug(f"Премиум пользователь {user_id}: увеличен лимит токенов до {max_tokens}")
     
     system_prompt = build_persona_system_prompt(persona)
     history: List[Dict[str, Any]] = [
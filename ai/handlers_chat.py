@@ -11,6 +11,7 @@ from aiogram.fsm.context import FSMContext
 from ai.chat import persona_context_from_dict, run_chat_turn
 from ai.chat_state import deactivate_persona_chat
 from ai.request_queue import get_request_lock
+from premium.cache import get_premium_info
 from SMS.tokens import consume_tokens, get_token_balance
 
 logger = logging.getLogger(__name__)
@@ -50,13 +51,8 @@ async def _process_message(
     # Проверяем баланс токенов (но не списываем пока)
     balance = get_token_balance(user_id)
     
-    # Проверяем безлимитный премиум статус
-    is_unlimited = False
-    try:
-        from premium.subscription import is_premium_unlimited
-        is_unlimited = is_premium_unlimited(user_id)
-    except Exception:
-        pass
+    # Проверяем безлимитный премиум статус (кэшированный, без импорта на каждый запрос)
+    is_unlimited = get_premium_info(user_id).unlimited
     
     # Если не безлимит и баланс недостаточен - отказываем
     if not is_unlimited and balance < 1:
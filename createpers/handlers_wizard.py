@@ -3,27 +3,40 @@
 Альтернатива FSM - все поля редактируются через inline-кнопки.
 """
 
+import asyncio
+import logging
 import os
+import tempfile
+
 from aiogram import Dispatcher, Bot
 from aiogram.filters import Command, BaseFilter
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-from .wizard import PersonaDraft, get_wizard_keyboard, format_draft_preview
+from .wizard import PersonaDraft, get_wizard_keyboard, format_draft_preview, missing_fields_from_dict
 from knops.keyboards import get_reply_main_menu
-from pers.database import create_persona
+from pers.database import create_persona, check_name_available
 from pers.storage import save_photo
 from knops.api_persons import invalidate_cache
+from knops.background import spawn
+from features.my_chars.handlers import invalidate_user_profiles
 from ai.chat_state import deactivate_persona_chat
 
-PERS_DIR = os.path.join(os.path.dirname(__file__), "..", "pers")
-USERS_DIR = os.path.join(PERS_DIR, "users")
+logger = logging.getLogger(__name__)
+
+# Пользователи с активным мастером. Быстрый пре-чек для WizardEditingFilter:
+# фильтр срабатывает на каждое входящее сообщение, и без этого множества
+# каждое сообщение стоило бы обращения к FSM-хранилищу (Redis на проде).
+_wizard_active: set[int] = set()
 
 
 class WizardEditingFilter(BaseFilter):
     """Фильтр, проверяющий активность режима редактирования в мастере"""
-    
+
     async def __call__(self, message: Message, state: FSMContext) -> bool:
+        user_id = message.from_user.id if message.from_user else 0
+        if user_id not in _wizard_active:
+            return False
         data = await state.get_data()
         return bool(data.get("wizard_editing") and data.get("wizard_draft"))
 
@@ -51,11 +64,9 @@ async def start_wizard(msg: Message, state: FSMContext) -> None:
         return
     
     draft = PersonaDraft(owner_id=user_id)
-    
-    await state.update_data(wizard_draft=draft.to_dict())
-    await state.update_data(wizard_editing=None)
-    
-    await msg.answer(
+    _wizard_active.add(user_id)
+
+    sent = await msg.answer(
         "🎨 <b>Мастер создания персонажа</b>\n\n"
         "Нажми на любое поле, чтобы заполнить или изменить его.\n"
         "Все поля можно редактировать в любой момент.",
@@ -63,6 +74,12 @@ async def start_wizard(msg: Message, state: FSMContext) -> None:
         reply_markup=get_wizard_keyboard(draft)
     )
 
+    await state.update_data(
+        wizard_draft=draft.to_dict(),
+        wizard_editing=None,
+        wizard_message_id=sent.message_id,
+    )
+
 
 async def handle_wizard_edit(call: CallbackQuery, state: FSMContext) -> None:
     """Обрабатывает нажатие на кнопку редактирования поля"""
@@ -72,7 +89,11 @@ async def handle_wizard_edit(call: CallbackQuery, state: FSMContext) -> None:
         return
     
     field = call.data.split(":")[-1]  # wizard:edit:photo -> photo
-    
+
+    if call.from_user:
+        # На случай перезапуска бота с персистентным FSM-хранилищем
+        _wizard_active.add(call.from_user.id)
+
     data = await state.get_data()
     draft_dict = data.get("wizard_draft", {})
     draft = PersonaDraft.from_dict(draft_dict)
@@ -217,37 +238,63 @@ async def handle_wizard_input(msg: Message, state: FSMContext) -> None:
         draft.initial_scene = initial_scene
         await msg.answer(f"✅ Начальная сцена сохранена! ({len(initial_scene)} символов)\n\n💡 <i>Старое значение полностью заменено новым.</i>", parse_mode="HTML")
     
-    # Сохраняем обновленный черновик
-    await state.update_data(wizard_draft=draft.to_dict())
-    await state.update_data(wizard_editing=None)
-    
-    # Показываем обновленную клавиатуру
-    await msg.answer(
-        "🎨 <b>Мастер создания персонажа</b>\n\n"
-        "Нажми на любое поле, чтобы заполнить или изменить его.",
-        parse_mode="HTML",
-        reply_markup=get_wizard_keyboard(draft)
+    # Обновляем клавиатуру на уже отправленной карточке мастера вместо
+    # нового сообщения — вдвое меньше исходящих запросов на каждый ввод
+    keyboard = get_wizard_keyboard(draft)
+    wizard_message_id = data.get("wizard_message_id")
+    edited = False
+    if wizard_message_id:
+        try:
+            await msg.bot.edit_message_reply_markup(
+                chat_id=msg.chat.id,
+                message_id=wizard_message_id,
+                reply_markup=keyboard,
+            )
+            edited = True
+        except Exception:
+            # Карточка удалена или клавиатура не изменилась — отправим новую
+            edited = False
+
+    if not edited:
+        sent = await msg.answer(
+            "🎨 <b>Мастер создания персонажа</b>\n\n"
+            "Нажми на любое поле, чтобы заполнить или изменить его.",
+            parse_mode="HTML",
+            reply_markup=keyboard
+        )
+        wizard_message_id = sent.message_id
+
+    # Сохраняем обновленный черновик (одним обращением к хранилищу FSM)
+    await state.update_data(
+        wizard_draft=draft.to_dict(),
+        wizard_editing=None,
+        wizard_message_id=wizard_message_id,
     )
 
 
+# Блокировки создания по владельцу — защита от двойного создания
+# при повторном нажатии «Создать персонажа»
+_confirm_locks: dict[int, asyncio.Lock] = {}
+
+
 async def handle_wizard_confirm(call: CallbackQuery, state: FSMContext, bot: Bot) -> None:
     """Подтверждает создание персонажа"""
     await call.answer()
-    
+
     data = await state.get_data()
     draft_dict = data.get("wizard_draft", {})
     draft = PersonaDraft.from_dict(draft_dict)
-    
+
     if not draft.is_complete():
         missing = draft.get_missing_fields()
         await call.message.answer(
             f"❌ Заполните все обязательные поля: {', '.join(missing)}"
         )
         return
-    
+
     # Показываем превью
     preview_text = format_draft_preview(draft)
-    
+
     # Добавляем сообщение о создании, проверяя лимит
     creating_msg = "\n\n💾 Создаю персонажа..."
     if len(preview_text) + len(creating_msg) > 4096:
@@ -259,110 +306,148 @@ async def handle_wizard_confirm(call: CallbackQuery, state: FSMContext, bot: Bot
             preview_text + creating_msg,
             parse_mode="HTML"
         )
-    
-    # Создаем персонажа
+
+    # Тяжелую часть (скачивание фото, загрузка в облако, запись в БД)
+    # выполняем в фоне через spawn: задача удерживается от сборки мусора,
+    # а wait_all при остановке бота дожидается ее завершения
+    spawn(_finalize_persona(bot, call.message.chat.id, draft, state))
+
+
+async def _download_photo(bot: Bot, photo_id: str) -> bytes:
+    """Скачивает фото из Telegram во временный файл и возвращает его байты"""
+    photo = await bot.get_file(photo_id)
+    tmp_path = None
     try:
-        owner_id = draft.owner_id
-        
-        # Скачиваем фото
-        photo_path = None
-        photo_url = None
-        if draft.photo_id:
-            photo = await bot.get_file(draft.photo_id)
-            # Скачиваем во временный файл
-            import tempfile
-            tmp_path = None
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-                    tmp_path = tmp_file.name
-                    await bot.download_file(photo.file_path, tmp_path)
-                
-                # Читаем файл
-                with open(tmp_path, "rb") as f:
-                    file_data = f.read()
-            finally:
-                # Удаляем временный файл
-                if tmp_path and os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
-            
-            # Сохраняем фото (в Yandex Object Storage для всех персонажей, если настроено)
-            # Все фото (опубликованные и неопубликованные) сохраняются в одно место
-            import logging
-            logger = logging.getLogger(__name__)
-            
-            storage_type = os.getenv("STORAGE_TYPE", "local")
-            yandex_bucket = os.getenv("YANDEX_BUCKET")
-            yandex_key = os.getenv("YANDEX_ACCESS_KEY_ID")
-            
-            # Логируем настройки для отладки
-            logger.info(f"STORAGE_TYPE={storage_type}, YANDEX_BUCKET={'установлен' if yandex_bucket else 'НЕ установлен'}, YANDEX_KEY={'установлен' if yandex_key else 'НЕ установлен'}")
-            
-            # Явно передаем тип хранилища, чтобы все персонажи сохранялись одинаково
-            photo_path, photo_url = await save_photo(
-                file_data,
-                owner_id,
-                draft.name,
-                storage_type=storage_type,  # Используем тип из переменной окружения
-            )
-            
-            # Логируем результат
-            if photo_url:
-                logger.info(f"Фото сохранено в облако: {photo_url}")
-            else:
-                logger.warning(f"Фото сохранено локально: {photo_path}")
-        
-        # Создаем персонажа в БД (использует параметризованные запросы - безопасно!)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
+            tmp_path = tmp_file.name
+            await bot.download_file(photo.file_path, tmp_path)
+
+        with open(tmp_path, "rb") as f:
+            return f.read()
+    finally:
+        # Удаляем временный файл
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+async def _finalize_persona(bot: Bot, chat_id: int, draft: PersonaDraft, state: FSMContext) -> None:
+    """Фоновое завершение создания: фото, облако, БД, итоговое сообщение"""
+    owner_id = draft.owner_id
+    lock = _confirm_locks.setdefault(owner_id, asyncio.Lock())
+    if lock.locked():
+        return  # Создание уже идет — повторное нажатие игнорируем
+
+    async with lock:
         try:
-            persona_id = create_persona(
-                owner_id=owner_id,
-                name=draft.name,
-                age=draft.age,
-                description=draft.description,
-                character=draft.character,
-                scene=draft.scene,
-                initial_scene=draft.initial_scene,
-                photo_path=photo_path,
-                photo_url=photo_url,
-                public=False,
-            )
-        except Exception as db_error:
-            error_str = str(db_error)
-            if "UNIQUE constraint failed" in error_str or "UNIQUE constraint" in error_str:
-                await call.message.answer(
+            photo_path = None
+            photo_url = None
+            file_data = None
+
+            # Проверку имени и скачивание фото выполняем параллельно:
+            # при занятом имени вообще не тратим трафик на загрузку в облако
+            if draft.photo_id:
+                name_ok, file_data = await asyncio.gather(
+                    asyncio.to_thread(check_name_available, owner_id, draft.name),
+                    _download_photo(bot, draft.photo_id),
+                )
+            else:
+                name_ok = await asyncio.to_thread(check_name_available, owner_id, draft.name)
+
+            if not name_ok:
+                await bot.send_message(
+                    chat_id,
                     f"❌ Персонаж с именем «{draft.name}» уже существует!\n"
                     f"У тебя уже есть персонаж с таким именем. Выбери другое имя.",
                     reply_markup=get_reply_main_menu(),
                 )
                 # Очищаем состояние
-                await state.update_data(wizard_draft=None)
-                await state.update_data(wizard_editing=None)
+                _wizard_active.discard(owner_id)
+                await state.update_data(wizard_draft=None, wizard_editing=None)
                 return
-            else:
-                raise  # Пробрасываем другие ошибки дальше
-        
-        invalidate_cache()
-        
-        await call.message.answer(
-            "✅ Персонаж создан! Теперь он доступен в разделе «Мои персонажи».",
-            reply_markup=get_reply_main_menu(),
-        )
-        
-        # Очищаем состояние
-        await state.update_data(wizard_draft=None)
-        await state.update_data(wizard_editing=None)
-        
-    except Exception as e:
-        await call.message.answer(
-            f"❌ Ошибка при создании персонажа: {str(e)}",
-            reply_markup=get_reply_main_menu(),
-        )
+
+            if file_data is not None:
+                # Сохраняем фото (в Yandex Object Storage для всех персонажей, если настроено)
+                # Все фото (опубликованные и неопубликованные) сохраняются в одно место
+                storage_type = os.getenv("STORAGE_TYPE", "local")
+                yandex_bucket = os.getenv("YANDEX_BUCKET")
+                yandex_key = os.getenv("YANDEX_ACCESS_KEY_ID")
+
+                # Логируем настройки для отладки
+                logger.info(f"STORAGE_TYPE={storage_type}, YANDEX_BUCKET={'установлен' if yandex_bucket else 'НЕ установлен'}, YANDEX_KEY={'установлен' if yandex_key else 'НЕ установлен'}")
+
+                # Явно передаем тип хранилища, чтобы все персонажи сохранялись одинаково
+                photo_path, photo_url = await save_photo(
+                    file_data,
+                    owner_id,
+                    draft.name,
+                    storage_type=storage_type,  # Используем тип из переменной окружения
+                )
+
+                # Логируем результат
+                if photo_url:
+                    logger.info(f"Фото сохранено в облако: {photo_url}")
+                else:
+                    logger.warning(f"Фото сохранено локально: {photo_path}")
+
+            # Создаем персонажа в БД (использует параметризованные запросы - безопасно!)
+            try:
+                persona_id = create_persona(
+                    owner_id=owner_id,
+                    name=draft.name,
+                    age=draft.age,
+                    description=draft.description,
+                    character=draft.character,
+                    scene=draft.scene,
+                    initial_scene=draft.initial_scene,
+                    photo_path=photo_path,
+                    photo_url=photo_url,
+                    public=False,
+                )
+            except Exception as db_error:
+                error_str = str(db_error)
+                if "UNIQUE constraint failed" in error_str or "UNIQUE constraint" in error_str:
+                    await bot.send_message(
+                        chat_id,
+                        f"❌ Персонаж с именем «{draft.name}» уже существует!\n"
+                        f"У тебя уже есть персонаж с таким именем. Выбери другое имя.",
+                        reply_markup=get_reply_main_menu(),
+                    )
+                    # Очищаем состояние
+                    _wizard_active.discard(owner_id)
+                    await state.update_data(wizard_draft=None, wizard_editing=None)
+                    return
+                else:
+                    raise  # Пробрасываем другие ошибки дальше
+
+            invalidate_cache()
+            # Сбрасываем и кэш списка «Мои персонажи», иначе новый персонаж
+            # не виден владельцу до истечения TTL
+            invalidate_user_profiles(owner_id)
+
+            await bot.send_message(
+                chat_id,
+                "✅ Персонаж создан! Теперь он доступен в разделе «Мои персонажи».",
+                reply_markup=get_reply_main_menu(),
+            )
+
+            # Очищаем состояние
+            _wizard_active.discard(owner_id)
+            await state.update_data(wizard_draft=None, wizard_editing=None)
+
+        except Exception as e:
+            await bot.send_message(
+                chat_id,
+                f"❌ Ошибка при создании персонажа: {str(e)}",
+                reply_markup=get_reply_main_menu(),
+            )
 
 
 async def handle_wizard_cancel(call: CallbackQuery, state: FSMContext) -> None:
     """Отменяет создание персонажа"""
     await call.answer("Создание отменено")
-    await state.update_data(wizard_draft=None)
-    await state.update_data(wizard_editing=None)
+    if call.from_user:
+        _wizard_active.discard(call.from_user.id)
+    await state.update_data(wizard_draft=None, wizard_editing=None)
     await call.message.answer(
         "❌ Создание персонажа отменено.",
         reply_markup=get_reply_main_menu()
@@ -373,8 +458,8 @@ async def handle_wizard_help(call: CallbackQuery, state: FSMContext) -> None:
     """Показывает подсказку о незаполненных полях"""
     data = await state.get_data()
     draft_dict = data.get("wizard_draft", {})
-    draft = PersonaDraft.from_dict(draft_dict)
-    missing = draft.get_missing_fields()
+    # Считаем незаполненные поля прямо по словарю, без сборки dataclass
+    missing = missing_fields_from_dict(draft_dict)
     await call.answer(
         f"Заполните: {', '.join(missing)}",
         show_alert=True
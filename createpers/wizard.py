@@ -64,6 +64,30 @@ class PersonaDraft:
         return missing
 
 
+def missing_fields_from_dict(data: dict) -> list[str]:
+    """
+    То же, что PersonaDraft.get_missing_fields, но читает напрямую из словаря
+    FSM-данных — без создания экземпляра dataclass.
+    """
+    MIN_LENGTH = 150
+    missing = []
+    if not data.get("photo_id"):
+        missing.append("Фото")
+    if not data.get("name"):
+        missing.append("Имя")
+    if data.get("age") is None:
+        missing.append("Возраст")
+    if not data.get("description"):
+        missing.append("Описание")
+    if len(data.get("character") or "") < MIN_LENGTH:
+        missing.append(f"Характер (минимум {MIN_LENGTH} символов)")
+    if len(data.get("scene") or "") < MIN_LENGTH:
+        missing.append(f"Сцена (минимум {MIN_LENGTH} символов)")
+    if len(data.get("initial_scene") or "") < MIN_LENGTH:
+        missing.append(f"Начальная сцена (минимум {MIN_LENGTH} символов)")
+    return missing
+
+
 def get_wizard_keyboard(draft: PersonaDraft, editing_field: Optional[str] = None) -> InlineKeyboardMarkup:
     """
     Создает клавиатуру для мастера создания персонажа.
@@ -209,83 +233,63 @@ def _truncate_text(text: str, max_length: int) -> str:
     return truncated + "..."
 
 
+# Длинные текстовые поля превью: (заголовок, атрибут, мин. длина, текст-заглушка)
+_PREVIEW_FIELDS = [
+    ("📝 Описание", "description", None, "❌ Не указано"),
+    ("🎭 Характер", "character", 150, "❌ Не указан"),
+    ("📍 Сцена", "scene", 150, "❌ Не указана"),
+    ("🎬 Начальная сцена", "initial_scene", 150, "❌ Не указана"),
+]
+
+MAX_FIELD_PREVIEW = 500  # Максимальная длина поля в превью
+
+
+def _fmt_long_field(label: str, value: Optional[str], min_len: Optional[int], empty_text: str) -> str:
+    """Форматирует одну строку превью для длинного текстового поля."""
+    if not value:
+        if min_len:
+            return f"{label}: {empty_text} (минимум {min_len} символов)"
+        return f"{label}: {empty_text}"
+    val_len = len(value)
+    if min_len and val_len < min_len:
+        return f"{label}: ⚠️ {value[:MAX_FIELD_PREVIEW]}... (только {val_len}/{min_len} символов)"
+    text = _truncate_text(value, MAX_FIELD_PREVIEW) if val_len > MAX_FIELD_PREVIEW else value
+    counter = f"{val_len}/{min_len}" if min_len else str(val_len)
+    return f"{label} ({counter} символов): {text}"
+
+
 def format_draft_preview(draft: PersonaDraft) -> str:
     """Форматирует превью черновика для подтверждения"""
-    MIN_LENGTH = 150
     TELEGRAM_MAX_LENGTH = 4096  # Лимит Telegram для сообщений
-    MAX_FIELD_PREVIEW = 500  # Максимальная длина поля в превью
-    
+
     lines = ["📋 <b>Превью персонажа:</b>\n"]
-    
+
     if draft.photo_id:
         lines.append("📷 Фото: ✅ Загружено")
     else:
         lines.append("📷 Фото: ❌ Не загружено")
-    
+
     lines.append(f"👤 Имя: {draft.name or '❌ Не указано'}")
     lines.append(f"🎂 Возраст: {draft.age or '❌ Не указан'}")
-    
-    # Описание с обрезкой и счетчиком символов
-    description = draft.description or '❌ Не указано'
-    if draft.description:
-        desc_len = len(draft.description)
-        if desc_len > MAX_FIELD_PREVIEW:
-            description = _truncate_text(draft.description, MAX_FIELD_PREVIEW)
-            lines.append(f"📝 Описание ({desc_len} символов): {description}")
-        else:
-            lines.append(f"📝 Описание ({desc_len} символов): {description}")
-    else:
-        lines.append(f"📝 Описание: {description}")
-    
-    # Характер с обрезкой и счетчиком символов
-    if draft.character and len(draft.character) >= MIN_LENGTH:
-        char_len = len(draft.character)
-        char_text = draft.character
-        if char_len > MAX_FIELD_PREVIEW:
-            char_text = _truncate_text(draft.character, MAX_FIELD_PREVIEW)
-        lines.append(f"🎭 Характер ({char_len}/{MIN_LENGTH} символов): {char_text}")
-    elif draft.character:
-        char_len = len(draft.character)
-        lines.append(f"🎭 Характер: ⚠️ {draft.character[:MAX_FIELD_PREVIEW]}... (только {char_len}/{MIN_LENGTH} символов)")
-    else:
-        lines.append(f"🎭 Характер: ❌ Не указан (минимум {MIN_LENGTH} символов)")
-    
-    # Сцена с обрезкой и счетчиком символов
-    if draft.scene and len(draft.scene) >= MIN_LENGTH:
-        scene_len = len(draft.scene)
-        scene_text = draft.scene
-        if scene_len > MAX_FIELD_PREVIEW:
-            scene_text = _truncate_text(draft.scene, MAX_FIELD_PREVIEW)
-        lines.append(f"📍 Сцена ({scene_len}/{MIN_LENGTH} символов): {scene_text}")
-    elif draft.scene:
-        scene_len = len(draft.scene)
-        lines.append(f"📍 Сцена: ⚠️ {draft.scene[:MAX_FIELD_PREVIEW]}... (только {scene_len}/{MIN_LENGTH} символов)")
-    else:
-        lines.append(f"📍 Сцена: ❌ Не указана (минимум {MIN_LENGTH} символов)")
-    
-    # Начальная сцена с обрезкой и счетчиком символов
-    if draft.initial_scene and len(draft.initial_scene) >= MIN_LENGTH:
-        initial_len = len(draft.initial_scene)
-        initial_text = draft.initial_scene
-        if initial_len > MAX_FIELD_PREVIEW:
-            initial_text = _truncate_text(draft.initial_scene, MAX_FIELD_PREVIEW)
-        lines.append(f"🎬 Начальная сцена ({initial_len}/{MIN_LENGTH} символов): {initial_text}")
-    elif draft.initial_scene:
-        initial_len = len(draft.initial_scene)
-        lines.append(f"🎬 Начальная сцена: ⚠️ {draft.initial_scene[:MAX_FIELD_PREVIEW]}... (только {initial_len}/{MIN_LENGTH} символов)")
-    else:
-        lines.append(f"🎬 Начальная сцена: ❌ Не указана (минимум {MIN_LENGTH} символов)")
-    
+
+    # Длинные поля с обрезкой и счетчиком символов — одним циклом
+    for label, attr, min_len, empty_text in _PREVIEW_FIELDS:
+        lines.append(_fmt_long_field(label, getattr(draft, attr), min_len, empty_text))
+
     preview_text = "\n".join(lines)
-    
+
     # Обрезаем весь текст, если он превышает лимит Telegram
     total_length = len(preview_text)
     if total_length > TELEGRAM_MAX_LENGTH:
-        preview_text = _truncate_text(preview_text, TELEGRAM_MAX_LENGTH - 50)
-        preview_text += f"\n\n⚠️ <i>Превью обрезано (было {total_length} символов, лимит Telegram: {TELEGRAM_MAX_LENGTH})</i>"
-    
+        preview_text = "\n\n".join((
+            _truncate_text(preview_text, TELEGRAM_MAX_LENGTH - 50),
+            f"⚠️ <i>Превью обрезано (было {total_length} символов, лимит Telegram: {TELEGRAM_MAX_LENGTH})</i>",
+        ))
+
     # Добавляем общий счетчик символов
-    preview_text += f"\n\n📊 <b>Общая длина превью: {len(preview_text)}/{TELEGRAM_MAX_LENGTH} символов</b>"
-    
-    return preview_text
+    return "\n".join((
+        preview_text,
+        "",
+        f"📊 <b>Общая длина превью: {len(preview_text)}/{TELEGRAM_MAX_LENGTH} символов</b>",
+    ))
 
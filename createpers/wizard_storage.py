@@ -6,68 +6,169 @@
 
 from __future__ import annotations
 
+import asyncio
 import sqlite3
 import json
 import os
 import logging
+import threading
+import time
 from typing import Optional
 from contextlib import contextmanager
 from .wizard import PersonaDraft
 
 logger = logging.getLogger(__name__)
 
+# Опционально используем C-ускоренный orjson: сериализация черновика
+# выполняется на каждом сохранении, stdlib json здесь заметно дороже
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _dumps(data: dict):
+    """Сериализует словарь черновика (bytes при orjson, str при stdlib json)."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _loads(raw) -> dict:
+    """Десериализует черновик из строки или bytes."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
 # БД в папке pers для единообразия
 DB_PATH = os.path.join(os.path.dirname(__file__), "..", "pers", "wizard_drafts.db")
 
-
-@contextmanager
-def get_db_connection():
-    """Контекстный менеджер для работы с БД черновиков"""
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    try:
-        yield conn
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"Ошибка БД черновиков: {e}")
-        raise
-    finally:
-        conn.close()
+# Единственное долгоживущее соединение: открывать/закрывать SQLite на каждую
+# операцию с черновиком дорого (парсинг заголовка, mmap WAL-области и т.д.)
+_conn: Optional[sqlite3.Connection] = None
+_conn_lock = threading.Lock()
 
 
-def init_db() -> None:
-    """Инициализирует базу данных для черновиков"""
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        # Используем параметризованный запрос (безопасно!)
-        cursor.execute("""
+def _get_connection() -> sqlite3.Connection:
+    """
+    Возвращает общее соединение с БД черновиков.
+    При первом вызове создает соединение и схему — дальше это просто
+    проверка одного условия, без повторного CREATE TABLE на каждую операцию.
+    """
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        # Оптимизации для производительности (как в pers/database.py)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS drafts (
                 user_id INTEGER PRIMARY KEY,
                 draft_data TEXT NOT NULL,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
-        # commit выполняется автоматически контекстным менеджером
+        conn.commit()
+        _conn = conn
+    return _conn
+
+
+@contextmanager
+def get_db_connection():
+    """Контекстный менеджер для работы с БД черновиков"""
+    conn = _get_connection()
+    with _conn_lock:
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка БД черновиков: {e}")
+            raise
+
+
+def init_db() -> None:
+    """Инициализирует базу данных для черновиков (схема создается при первом соединении)"""
+    _get_connection()
+
+
+# Дебаунс автосохранений: быстрые последовательные save_draft склеиваются
+# в одну транзакцию (один fsync на пачку вместо fsync на каждое поле)
+_pending: dict[int, PersonaDraft] = {}
+_flush_task: Optional[asyncio.Task] = None
+FLUSH_INTERVAL = 0.5  # секунды
+
+
+def _flush_pending() -> None:
+    """Записывает все накопленные черновики одной транзакцией."""
+    if not _pending:
+        return
+    drafts = list(_pending.items())
+    _pending.clear()
+
+    # Формат CURRENT_TIMESTAMP, но вычисленный один раз на всю пачку
+    now = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+    conn = _get_connection()
+    with _conn_lock:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # UPSERT вместо INSERT OR REPLACE: обновление на месте,
+            # без удаления старой строки и перезаписи страницы B-дерева
+            conn.executemany("""
+                INSERT INTO drafts (user_id, draft_data, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    draft_data = excluded.draft_data,
+                    updated_at = excluded.updated_at
+            """, [
+                (uid, _dumps(d.to_dict()), now)
+                for uid, d in drafts
+            ])
+            conn.commit()
+            logger.info(f"Сохранено черновиков: {len(drafts)}")
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка БД черновиков: {e}")
+            raise
+
+
+async def _flush_loop() -> None:
+    """Фоновая задача: периодически сбрасывает накопленные черновики в БД."""
+    global _flush_task
+    try:
+        while _pending:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                _flush_pending()
+            except Exception:
+                pass  # Ошибка уже залогирована в _flush_pending
+    finally:
+        _flush_task = None
 
 
 def save_draft(user_id: int, draft: PersonaDraft) -> None:
     """
     Сохраняет черновик в базу данных.
-    Использует параметризованные запросы для защиты от SQL инъекций.
+    Быстрые повторные сохранения одного пользователя коалесцируются
+    фоновой задачей в одну транзакцию.
     """
-    init_db()
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        draft_json = json.dumps(draft.to_dict(), ensure_ascii=False)
-        # Параметризованный запрос - безопасно!
-        cursor.execute("""
-            INSERT OR REPLACE INTO drafts (user_id, draft_data, updated_at)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-        """, (user_id, draft_json))
-        # commit выполняется автоматически контекстным менеджером
-        logger.info(f"Черновик сохранен для user_id={user_id}")
+    global _flush_task
+    _pending[user_id] = draft
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Вне event loop (скрипты, тесты) — пишем сразу
+        _flush_pending()
+        return
+
+    if _flush_task is None or _flush_task.done():
+        _flush_task = loop.create_task(_flush_loop())
 
 
 def load_draft(user_id: int) -> Optional[PersonaDraft]:
@@ -75,7 +176,11 @@ def load_draft(user_id: int) -> Optional[PersonaDraft]:
     Загружает черновик из базы данных.
     Использует параметризованные запросы для защиты от SQL инъекций.
     """
-    init_db()
+    # Черновик мог еще не успеть записаться фоновой задачей
+    pending = _pending.get(user_id)
+    if pending is not None:
+        return pending
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
         # Параметризованный запрос - безопасно!
@@ -86,7 +191,7 @@ def load_draft(user_id: int) -> Optional[PersonaDraft]:
             return None
         
         try:
-            draft_dict = json.loads(row[0])
+            draft_dict = _loads(row[0])
             return PersonaDraft.from_dict(draft_dict)
         except Exception as e:
             logger.error(f"Ошибка загрузки черновика: {e}")
@@ -98,7 +203,7 @@ def delete_draft(user_id: int) -> None:
     Удаляет черновик из базы данных.
     Использует параметризованные запросы для защиты от SQL инъекций.
     """
-    init_db()
+    _pending.pop(user_id, None)
     with get_db_connection() as conn:
         cursor = conn.cursor()
         # Параметризованный запрос - безопасно!
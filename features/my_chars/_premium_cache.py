@@ -0,0 +1,34 @@
+"""
+TTL-кэш премиум-статуса для обработчиков «Мои персонажи».
+Каждый клик по карусели раньше ходил в БД за is_premium — кэшируем
+результат на короткое время (по образцу кэша в knops.api_persons).
+"""
+
+from __future__ import annotations
+
+import time
+
+from premium.subscription import is_premium
+
+_cache: dict[int, tuple[bool, float]] = {}
+CACHE_TTL = 60  # Время жизни кэша в секундах (1 минута)
+
+
+def cached_is_premium(user_id: int) -> bool:
+    """Возвращает премиум-статус пользователя, кэшируя его на CACHE_TTL."""
+    now = time.time()
+    entry = _cache.get(user_id)
+    if entry is not None and (now - entry[1]) < CACHE_TTL:
+        return entry[0]
+
+    try:
+        value = is_premium(user_id)
+    except Exception:
+        value = False
+    _cache[user_id] = (value, now)
+    return value
+
+
+def invalidate_premium(user_id: int) -> None:
+    """Сбрасывает кэшированный статус (например, после покупки подписки)."""
+    _cache.pop(user_id, None)
@@ -8,7 +8,7 @@ from __future__ import annotations
 import logging
 from pers.database import delete_persona as db_delete_persona, get_persona_by_id
 from pers.storage import delete_photo
-from knops.api_persons import invalidate_cache
+from knops.api_persons import remove_cached_persona
 
 logger = logging.getLogger(__name__)
 
@@ -51,8 +51,8 @@ async def delete_user_persona(persona_id: int, user_id: int) -> tuple[bool, str]
     removed = db_delete_persona(persona_id)
     
     if removed:
-        # Очищаем кэш профилей после удаления
-        invalidate_cache()
+        # Точечно убираем персонажа из кэша профилей
+        remove_cached_persona(persona_id)
         logger.info(f"Персонаж ID={persona_id} удален пользователем user_id={user_id}")
         return True, "Персонаж успешно удален."
     else:
@@ -5,22 +5,34 @@
 
 from __future__ import annotations
 
+import asyncio
+import logging
+import time
 from typing import Dict, List
 
 from aiogram import Dispatcher, Bot
 from aiogram.types import Message, CallbackQuery, FSInputFile, URLInputFile
 from aiogram.filters import BaseFilter
 from aiogram.fsm.context import FSMContext
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from knops.keyboards import (
     get_reply_my_characters_menu,
     get_my_person_card_keyboard,
 )
 from ai.chat_state import deactivate_persona_chat
-from knops.api_persons import invalidate_cache
-from pers.database import update_persona
-from pers.database import get_personas_by_owner, persona_to_dict, update_persona
+from knops.api_persons import update_cached_persona
+from knops.background import spawn
+from pers.database import (
+    get_personas_by_owner,
+    persona_to_dict,
+    set_persona_public,
+    update_persona,
+)
 from .delete_persona import delete_user_persona
+from ._premium_cache import cached_is_premium
+
+logger = logging.getLogger(__name__)
 
 
 def _truncate_caption(text: str, max_length: int = 1024) -> str:
@@ -30,36 +42,91 @@ def _truncate_caption(text: str, max_length: int = 1024) -> str:
     """
     if len(text) <= max_length:
         return text
-    
+
     # Обрезаем текст, оставляя место для "..."
     truncated = text[:max_length - 3]
-    
-    # Пытаемся найти безопасное место для обрезки (не внутри HTML-тега)
-    import re
-    # Если обрезали внутри открывающего тега, удаляем его
-    last_open_tag = re.search(r'<[^>]*$', truncated)
-    if last_open_tag:
-        truncated = truncated[:last_open_tag.start()]
-    
-    # Если обрезали внутри закрывающего тега, удаляем его
-    last_close_tag = re.search(r'</[^>]*$', truncated)
-    if last_close_tag:
-        truncated = truncated[:last_close_tag.start()]
-    
-    # Простая проверка: если последний символ - это часть HTML-сущности, обрезаем дальше
-    while truncated and truncated[-1] == '&':
-        truncated = truncated[:-1]
-    
+
+    # Пытаемся найти безопасное место для обрезки (не внутри HTML-тега):
+    # если последний '<' не закрыт ('>' раньше него) — обрезали внутри тега
+    lt = truncated.rfind('<')
+    if lt > truncated.rfind('>'):
+        truncated = truncated[:lt]
+
+    # Аналогично для HTML-сущности: незавершенный хвост вида "&amp" обрезаем
+    amp = truncated.rfind('&')
+    if amp != -1 and len(truncated) - amp <= 6 and ';' not in truncated[amp:]:
+        truncated = truncated[:amp]
+
     return truncated + "..."
 
 
+# Кэш списков персонажей по владельцу (аналогично knops.api_persons):
+# листание карусели — повторяющийся одинаковый запрос к БД
+_user_profiles: Dict[int, tuple] = {}
+USER_CACHE_TTL = 60  # Время жизни кэша в секундах (1 минута)
+
+
 def _load_profiles_for_user(user_id: int) -> List[Dict]:
-    """Загружает персонажей пользователя из БД"""
+    """Загружает персонажей пользователя из БД (с коротким TTL-кэшем)"""
+    now = time.time()
+    cached = _user_profiles.get(user_id)
+    if cached is not None and (now - cached[1]) < USER_CACHE_TTL:
+        return cached[0]
+
     personas = get_personas_by_owner(user_id, include_public=False)
     profiles = [persona_to_dict(row) for row in personas]
+    id_to_index = {p["id"]: i for i, p in enumerate(profiles)}
+    _user_profiles[user_id] = (profiles, now, id_to_index)
     return profiles
 
 
+def _profiles_id_index(user_id: int) -> Dict[int, int]:
+    """Возвращает отображение id персонажа -> позиция в кэшированном списке."""
+    cached = _user_profiles.get(user_id)
+    if cached is None:
+        _load_profiles_for_user(user_id)
+        cached = _user_profiles.get(user_id)
+    return cached[2] if cached else {}
+
+
+def invalidate_user_profiles(user_id: int) -> None:
+    """Сбрасывает кэш списка персонажей пользователя после изменения."""
+    _user_profiles.pop(user_id, None)
+
+
+def _patch_user_cache(user_id: int, persona_id: int, **fields) -> None:
+    """Точечно обновляет персонажа в кэшированном списке пользователя."""
+    cached = _user_profiles.get(user_id)
+    if cached is None:
+        return
+    idx = cached[2].get(persona_id)
+    if idx is not None:
+        cached[0][idx].update(fields)
+
+
+def _remove_from_user_cache(user_id: int, persona_id: int) -> None:
+    """Убирает персонажа из кэшированного списка без перезагрузки из БД."""
+    cached = _user_profiles.get(user_id)
+    if cached is None:
+        return
+    profiles, ts, id_to_index = cached
+    idx = id_to_index.get(persona_id)
+    if idx is None:
+        return
+    profiles.pop(idx)
+    _user_profiles[user_id] = (profiles, ts, {p["id"]: i for i, p in enumerate(profiles)})
+
+
+async def _persist_file_id(persona_id: int, new_file_id: str, owner_id: int) -> None:
+    """Фоновая запись photo_file_id в БД со сбросом кэшей."""
+    try:
+        await asyncio.to_thread(update_persona, persona_id, photo_file_id=new_file_id)
+        update_cached_persona(persona_id, photo_file_id=new_file_id)
+        _patch_user_cache(owner_id, persona_id, photo_file_id=new_file_id)
+    except Exception:
+        pass  # file_id — только кэш-оптимизация, при ошибке запишется в следующий раз
+
+
 async def _delete_last_photo_message(state: FSMContext, bot: Bot):
     """Удаляет последнее сообщение с фото, если оно есть"""
     try:
@@ -85,17 +152,11 @@ async def show_my_characters(msg: Message | CallbackQuery, state: FSMContext, bo
         receiver = msg
         user_id = msg.from_user.id
     
-    # Проверяем премиум статус
-    is_premium_user = False
-    try:
-        from premium.subscription import is_premium
-        is_premium_user = is_premium(user_id)
-    except Exception:
-        pass
+    # Проверяем премиум статус (с коротким TTL-кэшем)
+    is_premium_user = cached_is_premium(user_id)
     
     # Если нет премиума, показываем сообщение с кнопкой покупки
     if not is_premium_user:
-        from aiogram.utils.keyboard import InlineKeyboardBuilder
         builder = InlineKeyboardBuilder()
         builder.button(text="⭐ Купить премиум", callback_data="topup:premium")
         
@@ -130,13 +191,8 @@ async def my_char_next(call: CallbackQuery, state: FSMContext, bot: Bot) -> None
     await _delete_last_photo_message(state, bot)
     user_id = call.from_user.id
     
-    # Проверяем премиум статус
-    is_premium_user = False
-    try:
-        from premium.subscription import is_premium
-        is_premium_user = is_premium(user_id)
-    except Exception:
-        pass
+    # Проверяем премиум статус (с коротким TTL-кэшем)
+    is_premium_user = cached_is_premium(user_id)
     
     profiles = _load_profiles_for_user(user_id)
     if not profiles:
@@ -161,13 +217,8 @@ async def my_char_prev(call: CallbackQuery, state: FSMContext, bot: Bot) -> None
     await _delete_last_photo_message(state, bot)
     user_id = call.from_user.id
     
-    # Проверяем премиум статус
-    is_premium_user = False
-    try:
-        from premium.subscription import is_premium
-        is_premium_user = is_premium(user_id)
-    except Exception:
-        pass
+    # Проверяем премиум статус (с коротким TTL-кэшем)
+    is_premium_user = cached_is_premium(user_id)
     
     profiles = _load_profiles_for_user(user_id)
     if not profiles:
@@ -200,21 +251,16 @@ async def my_char_publish(call: CallbackQuery, state: FSMContext, bot: Bot) -> N
         return
     
     # Обновляем публичность в БД
-    from pers.database import set_persona_public
     set_persona_public(persona_id, True)
-    invalidate_cache()
+    update_cached_persona(persona_id, public=True)
+    _patch_user_cache(call.from_user.id, persona_id, public=True)
     
     await call.message.answer("Персонаж опубликован и теперь виден всем!")
     
     user_id = call.from_user.id
     
-    # Проверяем премиум статус
-    is_premium_user = False
-    try:
-        from premium.subscription import is_premium
-        is_premium_user = is_premium(user_id)
-    except Exception:
-        pass
+    # Проверяем премиум статус (с коротким TTL-кэшем)
+    is_premium_user = cached_is_premium(user_id)
     
     profiles = _load_profiles_for_user(user_id)
     if not profiles:
@@ -223,11 +269,7 @@ async def my_char_publish(call: CallbackQuery, state: FSMContext, bot: Bot) -> N
             reply_markup=get_reply_my_characters_menu(is_premium=is_premium_user),
         )
         return
-    idx = 0
-    for i, profile in enumerate(profiles):
-        if profile.get("id") == persona_id:
-            idx = i
-            break
+    idx = _profiles_id_index(user_id).get(persona_id, 0)
     await _send_profile(idx, call, state, profiles, bot)
 
 
@@ -262,12 +304,9 @@ async def my_char_edit_description(call: CallbackQuery, state: FSMContext) -> No
     # Проверяем, что персонаж принадлежит пользователю
     user_id = call.from_user.id
     profiles = _load_profiles_for_user(user_id)
-    persona = None
-    for p in profiles:
-        if p.get("id") == persona_id:
-            persona = p
-            break
-    
+    idx = _profiles_id_index(user_id).get(persona_id)
+    persona = profiles[idx] if idx is not None else None
+
     if not persona:
         await call.message.answer("Персонаж не найден или не принадлежит вам.")
         return
@@ -301,17 +340,14 @@ async def handle_description_input(msg: Message, state: FSMContext, bot: Bot) ->
     updated = update_persona(persona_id, description=new_description)
     
     if updated:
-        invalidate_cache()
+        update_cached_persona(persona_id, description=new_description)
+        _patch_user_cache(msg.from_user.id, persona_id, description=new_description)
         await msg.answer("✅ Описание успешно обновлено!")
         
         # Показываем обновленную карточку персонажа
         user_id = msg.from_user.id
         profiles = _load_profiles_for_user(user_id)
-        idx = 0
-        for i, profile in enumerate(profiles):
-            if profile.get("id") == persona_id:
-                idx = i
-                break
+        idx = _profiles_id_index(user_id).get(persona_id, 0)
         await _send_profile(idx, msg, state, profiles, bot, no_prev=idx == 0)
     else:
         await msg.answer("❌ Не удалось обновить описание. Попробуйте позже.")
@@ -342,15 +378,11 @@ async def my_char_delete(call: CallbackQuery, state: FSMContext, bot: Bot) -> No
     success, message = await delete_user_persona(persona_id, user_id)
     
     if success:
+        _remove_from_user_cache(user_id, persona_id)
         await call.message.answer(f"✅ {message}")
         
-        # Проверяем премиум статус
-        is_premium_user = False
-        try:
-            from premium.subscription import is_premium
-            is_premium_user = is_premium(user_id)
-        except Exception:
-            pass
+        # Проверяем премиум статус (с коротким TTL-кэшем)
+        is_premium_user = cached_is_premium(user_id)
         
         # Обновляем список персонажей
         profiles = _load_profiles_for_user(user_id)
@@ -409,8 +441,6 @@ async def _send_profile(
     # Проверяем, что photo_file_id не пустой и не None
     if photo_file_id and photo_file_id.strip():
         # Пробуем использовать кэшированный file_id - Telegram НЕ будет скачивать файл
-        import logging
-        logger = logging.getLogger(__name__)
         logger.info(f"Используем кэшированный file_id для persona_id={persona_id}: {photo_file_id[:20]}...")
         try:
             if isinstance(receiver, Message):
@@ -434,14 +464,10 @@ async def _send_profile(
             logger.warning(f"file_id невалиден для persona_id={persona_id}, загружаем файл: {e}")
             photo_file_id = None  # Сбрасываем невалидный file_id
     else:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.info(f"file_id отсутствует для persona_id={persona_id}, будет загружен файл")
     
     if not photo_file_id or not sent_message:
         # Первая отправка или file_id невалиден - загружаем файл
-        import logging
-        logger = logging.getLogger(__name__)
         logger.info(f"Загружаем файл для persona_id={persona_id} из {photo_path[:50] if photo_path else 'N/A'}...")
         if photo_path.startswith("http://") or photo_path.startswith("https://"):
             photo = URLInputFile(photo_path)
@@ -469,9 +495,10 @@ async def _send_profile(
             # Берем самое большое фото (последнее в массиве)
             new_file_id = sent_message.photo[-1].file_id
             logger.info(f"Сохраняем новый file_id для persona_id={persona_id}: {new_file_id[:20]}...")
-            update_persona(persona_id, photo_file_id=new_file_id)
-            # Обновляем кэш
-            invalidate_cache()
+            # Пишем file_id и сбрасываем кэши в фоне — пользователю
+            # карточка уже отправлена, ждать SQLite незачем. spawn держит
+            # ссылку на задачу, чтобы ее не собрал GC на полпути
+            spawn(_persist_file_id(persona_id, new_file_id, persona.get("owner_id")))
     
     # Сохраняем ID сообщения с фото для последующего удаления
     if sent_message:
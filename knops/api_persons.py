@@ -1,47 +1,167 @@
+import asyncio
+import threading
 import time
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 
 from pers.database import get_public_personas, persona_to_dict
 
-# Кэш для списка профилей (только метаданные, без загрузки фото)
-_profiles_cache: Optional[List[Dict]] = None
-_cache_timestamp: float = 0
+# Кэш списка профилей (только метаданные, без загрузки фото).
+# Хранится одним кортежем (profiles, by_id, timestamp): чтение — одно атомарное
+# обращение, обновление — подмена целиком под блокировкой, чтобы при
+# истекшем TTL БД не опрашивали несколько обработчиков одновременно.
+# by_id — индекс persona_id -> словарь персонажа для O(1) доступа из callback'ов.
+_cache: Optional[Tuple[List[Dict], Dict[int, Dict], float]] = None
+_refresh_lock = threading.Lock()
+_refreshing = False
+# Счетчики популярности бампаются прямо в кэше; пересортировка списка
+# откладывается до следующего чтения вместо полного сброса кэша
+_dirty_order = False
 CACHE_TTL = 60  # Время жизни кэша в секундах (1 минута)
 
 
+def _build_cache() -> Tuple[List[Dict], Dict[int, Dict], float]:
+    """Загружает профили из БД и строит кортеж кэша со вспомогательным индексом."""
+    personas = get_public_personas()
+    profiles = [persona_to_dict(row) for row in personas]
+    by_id = {p["id"]: p for p in profiles if p.get("id")}
+    return (profiles, by_id, time.time())
+
+
+def _refresh_cache() -> None:
+    """Перечитывает профили из БД и подменяет кортеж кэша."""
+    global _cache, _refreshing, _dirty_order
+    try:
+        _cache = _build_cache()
+        _dirty_order = False
+    finally:
+        _refreshing = False
+
+
+def _resort_if_dirty() -> None:
+    """Лениво пересортировывает кэш по популярности после bump_popularity."""
+    global _cache, _dirty_order
+    if not _dirty_order:
+        return
+    with _refresh_lock:
+        cached = _cache
+        _dirty_order = False
+        if cached is None:
+            return
+        # Тот же порядок, что и в get_public_personas: chat_count DESC, name ASC
+        profiles = sorted(
+            cached[0],
+            key=lambda p: (-(p.get("chat_count") or 0), p.get("name") or ""),
+        )
+        _cache = (profiles, cached[1], cached[2])
+
+
 def list_profiles(force_refresh: bool = False) -> List[Dict]:
     """
     Возвращает список всех ПУБЛИЧНЫХ персонажей из БД.
-    Использует кэширование для оптимизации.
-    
+    Использует кэширование для оптимизации: просроченный список отдается
+    сразу, а обновление выполняется в фоне (stale-while-revalidate).
+
     Args:
         force_refresh: Если True, принудительно обновляет кэш
     """
-    global _profiles_cache, _cache_timestamp
-    
-    current_time = time.time()
-    
-    # Проверяем кэш
-    if (
-        not force_refresh
-        and _profiles_cache is not None
-        and (current_time - _cache_timestamp) < CACHE_TTL
-    ):
-        return _profiles_cache
-    
-    # Загружаем публичные персонажи из БД
-    personas = get_public_personas()
-    profiles = [persona_to_dict(row) for row in personas]
-    
-    # Обновляем кэш
-    _profiles_cache = profiles
-    _cache_timestamp = current_time
-    
-    return profiles
+    global _cache, _refreshing
+
+    _resort_if_dirty()
+    cached = _cache
+    if not force_refresh and cached is not None:
+        if (time.time() - cached[2]) < CACHE_TTL:
+            return cached[0]
+
+        # TTL истек: возвращаем устаревший список немедленно,
+        # а перезагрузку из БД запускаем в фоне
+        if not _refreshing:
+            _refreshing = True
+            try:
+                asyncio.get_running_loop()
+                asyncio.create_task(asyncio.to_thread(_refresh_cache))
+            except RuntimeError:
+                threading.Thread(target=_refresh_cache, daemon=True).start()
+        return cached[0]
+
+    # Кэша нет (первый вызов или после invalidate) — загружаем синхронно
+    with _refresh_lock:
+        # Double-check: пока ждали блокировку, кэш мог обновить другой поток
+        cached = _cache
+        if (
+            not force_refresh
+            and cached is not None
+            and (time.time() - cached[2]) < CACHE_TTL
+        ):
+            return cached[0]
+
+        # Загружаем публичные персонажи из БД и обновляем кэш атомарной подменой
+        _cache = _build_cache()
+        return _cache[0]
+
+
+def get_cached_persona(persona_id: int) -> Optional[Dict]:
+    """
+    Возвращает публичного персонажа по ID за O(1) через индекс кэша.
+    Если кэш пуст, сначала загружает список профилей.
+    """
+    cached = _cache
+    if cached is None:
+        list_profiles()
+        cached = _cache
+        if cached is None:
+            return None
+    return cached[1].get(persona_id)
+
+
+def bump_popularity(persona_id: int) -> None:
+    """
+    Увеличивает счетчик популярности персонажа прямо в кэше.
+    Полный сброс кэша не нужен: в БД счетчик пишет
+    increment_persona_chat_count, а порядок списка обновится лениво.
+    """
+    global _dirty_order
+    with _refresh_lock:
+        cached = _cache
+        if cached is None:
+            return
+        profile = cached[1].get(persona_id)
+        if profile is None:
+            return
+        profile["chat_count"] = (profile.get("chat_count") or 0) + 1
+        _dirty_order = True
 
 
 def invalidate_cache() -> None:
     """Принудительно очищает кэш профилей."""
-    global _profiles_cache, _cache_timestamp
-    _profiles_cache = None
-    _cache_timestamp = 0
+    global _cache
+    _cache = None
+
+
+def update_cached_persona(persona_id: int, **fields) -> None:
+    """
+    Точечно обновляет поля персонажа в кэше вместо полного сброса.
+    Если персонажа в кэше нет, а он стал публичным — сбрасывает кэш целиком,
+    чтобы он появился при следующей загрузке.
+    """
+    with _refresh_lock:
+        cached = _cache
+        if cached is None:
+            return
+        profile = cached[1].get(persona_id)
+        if profile is not None:
+            profile.update(fields)
+            return
+    if fields.get("public"):
+        invalidate_cache()
+
+
+def remove_cached_persona(persona_id: int) -> None:
+    """Удаляет персонажа из кэша (после удаления или снятия с публикации)."""
+    global _cache
+    with _refresh_lock:
+        cached = _cache
+        if cached is None:
+            return
+        profiles = [p for p in cached[0] if p.get("id") != persona_id]
+        by_id = {p["id"]: p for p in profiles if p.get("id")}
+        _cache = (profiles, by_id, cached[2])
@@ -0,0 +1,25 @@
+"""
+Фоновые задачи для операций вне критического пути ответа пользователю
+(аналитика: дата регистрации, счетчики популярности).
+"""
+
+from __future__ import annotations
+
+import asyncio
+
+# Держим ссылки на задачи, чтобы их не собрал сборщик мусора до завершения
+_tasks: set[asyncio.Task] = set()
+
+
+def spawn(coro) -> asyncio.Task:
+    """Запускает корутину в фоне, не блокируя обработчик."""
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def wait_all(timeout: float = 5.0) -> None:
+    """Дожидается незавершенных фоновых задач (вызывается при остановке бота)."""
+    if _tasks:
+        await asyncio.wait(_tasks, timeout=timeout)
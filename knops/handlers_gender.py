@@ -2,10 +2,13 @@
 Обработчики событий, связанных с выбором пола пользователем.
 Здесь только логика реакций на нажатия кнопок (gender) и команда /start.
 """
-from aiogram import Dispatcher
+import asyncio
+
+from aiogram import Dispatcher, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
+from .background import spawn
 from .keyboards import get_gender_keyboard, get_main_menu_keyboard, get_reply_main_menu
 from .user_profiles import set_registration_date
 from ai.chat_state import deactivate_persona_chat
@@ -47,7 +50,8 @@ async def handle_gender_callback(callback: CallbackQuery, state: FSMContext):
         await deactivate_persona_chat(state)
         gender = data.split(":")[1]
         await state.update_data(gender=gender)
-        set_registration_date(user.id)
+        # Запись даты регистрации - не блокируем ответ пользователю
+        spawn(asyncio.to_thread(set_registration_date, user.id))
         await callback.message.answer(
             "Пол успешно выбран! Теперь доступен весь функционал бота.\n\nГлавное меню:",
             reply_markup=get_reply_main_menu()
@@ -59,4 +63,4 @@ def register_gender_handlers(dp: Dispatcher):
     (должно быть вызвано внутри main.py)
     """
     dp.message.register(start_command, Command("start"))
-    dp.callback_query.register(handle_gender_callback, lambda c: c.data and c.data.startswith("gender:"))
+    dp.callback_query.register(handle_gender_callback, F.data.startswith("gender:"))
@@ -1,5 +1,9 @@
-from aiogram import Dispatcher, Bot
-from aiogram.types import CallbackQuery, Message, FSInputFile, URLInputFile, InputFile
+import asyncio
+import logging
+import os
+
+from aiogram import Dispatcher, Bot, F
+from aiogram.types import CallbackQuery, Message, FSInputFile, URLInputFile, InputFile, InputMediaPhoto
 from aiogram.fsm.context import FSMContext
 import datetime
 from .keyboards import (
@@ -9,13 +13,29 @@ from .keyboards import (
     get_person_card_keyboard,
 )
 from .user_profiles import get_registration_date
-from SMS.tokens import get_token_balance, consume_tokens
-from knops.api_persons import list_profiles, invalidate_cache
+from SMS.tokens import get_token_balance, get_balance_cached, consume_tokens
+from knops.api_persons import list_profiles, invalidate_cache, get_cached_persona, bump_popularity, update_cached_persona
+from knops.background import spawn
 from features.my_chars.handlers import register_my_char_handlers
 from admin import is_admin, delete_persona
 from ai.chat import start_persona_chat, build_persona_intro, format_persona_response
 from ai.chat_state import deactivate_persona_chat
 from pers.database import update_persona, increment_persona_chat_count
+from premium.cache import get_premium_info
+
+logger = logging.getLogger(__name__)
+
+
+async def safe_answer(call: CallbackQuery, text: str | None = None):
+    """
+    Отвечает на callback query, молча пропуская ошибки (устаревший запрос,
+    сетевой сбой) вместо try/except в каждом обработчике. Ack — best-effort:
+    его провал не должен прерывать основную работу обработчика.
+    """
+    try:
+        await call.answer(text)
+    except Exception:
+        pass
 
 
 def _truncate_caption(text: str, max_length: int = 1024) -> str:
@@ -28,37 +48,40 @@ def _truncate_caption(text: str, max_length: int = 1024) -> str:
     
     # Обрезаем текст, оставляя место для "..."
     truncated = text[:max_length - 3]
-    
-    # Пытаемся найти безопасное место для обрезки (не внутри HTML-тега)
-    import re
-    # Если обрезали внутри открывающего тега, удаляем его
-    last_open_tag = re.search(r'<[^>]*$', truncated)
-    if last_open_tag:
-        truncated = truncated[:last_open_tag.start()]
-    
-    # Если обрезали внутри закрывающего тега, удаляем его
-    last_close_tag = re.search(r'</[^>]*$', truncated)
-    if last_close_tag:
-        truncated = truncated[:last_close_tag.start()]
-    
-    # Простая проверка: если последний символ - это часть HTML-сущности, обрезаем дальше
-    while truncated and truncated[-1] == '&':
-        truncated = truncated[:-1]
-    
+
+    # Быстрый путь: без HTML-разметки проверки тегов и сущностей не нужны
+    if '<' in truncated or '&' in truncated:
+        # Не обрезаем внутри HTML-тега: если последний '<' правее последнего '>',
+        # значит тег остался незакрытым - отбрасываем его
+        lt = truncated.rfind('<')
+        if lt > truncated.rfind('>'):
+            truncated = truncated[:lt]
+
+        # Аналогично не оставляем в конце незавершенную сущность ('&amp' без ';')
+        amp = truncated.rfind('&')
+        if amp != -1 and len(truncated) - amp <= 6 and ';' not in truncated[amp:]:
+            truncated = truncated[:amp]
+
     return truncated + "..."
 
 
-async def _delete_last_photo_message(state: FSMContext, bot: Bot):
-    """Удаляет последнее сообщение с фото, если оно есть"""
+async def _delete_last_photo_message(state: FSMContext, bot: Bot, reset_state: bool = True):
+    """
+    Удаляет последнее сообщение с фото, если оно есть.
+    reset_state=False, когда вызов идет параллельно с send_person_card:
+    та все равно перезапишет оба ключа, а так мы не затрем ее запись.
+    """
+    data = await state.get_data()
+    message_id = data.get("last_photo_message_id")
+    chat_id = data.get("last_photo_chat_id")
+    if not (message_id and chat_id):
+        return
     try:
-        data = await state.get_data()
-        message_id = data.get("last_photo_message_id")
-        chat_id = data.get("last_photo_chat_id")
-        if message_id and chat_id:
-            await bot.delete_message(chat_id=chat_id, message_id=message_id)
-            await state.update_data(last_photo_message_id=None, last_photo_chat_id=None)
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
     except Exception:
-        pass  # Игнорируем ошибки при удалении (сообщение уже удалено или недоступно)
+        return  # Игнорируем ошибки при удалении (сообщение уже удалено или недоступно)
+    if reset_state:
+        await state.update_data(last_photo_message_id=None, last_photo_chat_id=None)
 
 async def profile_menu_handler(msg: Message | CallbackQuery, state: FSMContext, bot: Bot):
     """
@@ -79,49 +102,21 @@ async def profile_menu_handler(msg: Message | CallbackQuery, state: FSMContext,
     username = user.username or f"id{user.id}"
     reg_date = get_registration_date(user.id) or "-"
     
-    # Проверяем премиум статус
-    premium_active = False
-    premium_text = ""
-    try:
-        from premium.subscription import is_premium, get_premium_expiry, get_premium_status, is_premium_unlimited
-        premium_active = is_premium(user.id)
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.info(f"Профиль user_id={user.id}: premium_active={premium_active}")
-        
-        if premium_active:
-            expiry = get_premium_expiry(user.id)
-            status = get_premium_status(user.id)
-            unlimited = is_premium_unlimited(user.id)
-            
-            logger.info(f"Профиль user_id={user.id}: expiry={expiry}, status={status}, unlimited={unlimited}")
-            
-            if expiry:
-                expiry_str = expiry.strftime("%d.%m.%Y")
-                premium_text = f"\n⭐ <b>Премиум активен</b> до {expiry_str}"
-            else:
-                premium_text = "\n⭐ <b>Премиум активен</b>"
-        else:
-            premium_text = ""  # Не показываем ничего, если премиум не активен
-    except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.error(f"Ошибка при проверке премиум статуса в профиле для user_id={user.id}: {e}", exc_info=True)
-        premium_text = ""
-        premium_active = False
-    
+    # Проверяем премиум статус (одно обращение к БД вместо четырех, с кэшем)
+    info = get_premium_info(user.id)
+    premium_active = info.active
+
+    if premium_active and info.expiry:
+        expiry_str = info.expiry.strftime("%d.%m.%Y")
+        premium_text = f"\n⭐ <b>Премиум активен</b> до {expiry_str}"
+    elif premium_active:
+        premium_text = "\n⭐ <b>Премиум активен</b>"
+    else:
+        premium_text = ""  # Не показываем ничего, если премиум не активен
+
     # Формируем текст баланса
-    if premium_active:
-        try:
-            from premium.subscription import is_premium_unlimited
-            if is_premium_unlimited(user.id):
-                balance_text = "♾️ Токены: <b>бесконечные</b> (премиум)"
-            else:
-                balance = get_token_balance(user.id)
-                balance_text = f"💰 Баланс: {balance} токенов"
-        except Exception:
-            balance = get_token_balance(user.id)
-            balance_text = f"💰 Баланс: {balance} токенов"
+    if premium_active and info.unlimited:
+        balance_text = "♾️ Токены: <b>бесконечные</b> (премиум)"
     else:
         balance = get_token_balance(user.id)
         balance_text = f"💰 Баланс: {balance} токенов"
@@ -144,8 +139,73 @@ async def profile_menu_handler(msg: Message | CallbackQuery, state: FSMContext,
     
     await receiver.answer(text, reply_markup=get_reply_section_menu(), parse_mode="HTML")
 
-async def send_person_card(index, receiver, state, bot: Bot, no_prev=False):
-    profiles = list_profiles()
+async def send_persona_photo(target: Message, persona, caption, markup=None, parse_mode='HTML'):
+    """
+    Отправляет фото персонажа с подписью.
+    Логика кэширования: сначала пробуем кэшированный photo_file_id (Telegram
+    не скачивает файл); если он невалиден или отсутствует - загружаем файл
+    и сохраняем новый file_id в БД для последующих отправок.
+    Возвращает отправленное сообщение или None, если у персонажа нет фото.
+    """
+    persona_id = persona.get("id")
+    photo_file_id = persona.get("photo_file_id")
+    photo_path = persona.get("photo")
+
+    # Подпись без разметки отправляем без parse_mode - Telegram не будет
+    # парсить сущности на своей стороне
+    if parse_mode == 'HTML' and '<' not in caption and '&' not in caption:
+        parse_mode = None
+
+    # Проверяем, что photo_file_id не пустой и не None
+    if photo_file_id and photo_file_id.strip():
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"Используем кэшированный file_id для persona_id={persona_id}: {photo_file_id[:20]}...")
+        try:
+            sent_message = await target.answer_photo(
+                photo_file_id,  # Передаем file_id как строку - Telegram использует кэш
+                caption=caption,
+                parse_mode=parse_mode,
+                reply_markup=markup,
+            )
+            # file_id работает - файл НЕ скачивался, используем кэш Telegram
+            logger.info(f"Успешно использован file_id для persona_id={persona_id}, файл НЕ скачивался")
+            return sent_message
+        except Exception as e:
+            # file_id невалиден (истек срок действия или файл удален) - загружаем файл
+            logger.warning(f"file_id невалиден для persona_id={persona_id}, загружаем файл: {e}")
+    else:
+        logger.info(f"file_id отсутствует для persona_id={persona_id}, будет загружен файл")
+
+    if not photo_path:
+        return None
+
+    # Первая отправка или file_id невалиден - загружаем файл
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"Загружаем файл для persona_id={persona_id} из {photo_path[:50]}...")
+    if photo_path.startswith(("http://", "https://")):
+        photo = URLInputFile(photo_path)
+    else:
+        photo = FSInputFile(photo_path)
+
+    # Отправляем фото (Telegram скачивает файл)
+    sent_message = await target.answer_photo(photo, caption=caption, parse_mode=parse_mode, reply_markup=markup)
+
+    # Сохраняем file_id в БД для последующих отправок
+    if persona_id and sent_message.photo:
+        # Берем самое большое фото (последнее в массиве)
+        new_file_id = sent_message.photo[-1].file_id
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"Сохраняем новый file_id для persona_id={persona_id}: {new_file_id[:20]}...")
+        update_persona(persona_id, photo_file_id=new_file_id)
+        # Точечно патчим запись в кэше - полный сброс и перезагрузка не нужны
+        update_cached_persona(persona_id, photo_file_id=new_file_id)
+    return sent_message
+
+
+async def send_person_card(index, receiver, state, bot: Bot, no_prev=False, profiles=None, edit_target=None):
+    # Вызывающий код уже получил список профилей - не запрашиваем повторно
+    if profiles is None:
+        profiles = list_profiles()
     if not profiles:
         await receiver.answer("Нет ни одного персонажа.")
         return
@@ -169,81 +229,81 @@ async def send_person_card(index, receiver, state, bot: Bot, no_prev=False):
         module_file=None,  # Больше не используется, оставлено для совместимости
         can_delete=bool(persona_id and is_admin(user_id)),
         can_chat=bool(persona_id),
-        person_index=index,  # Используем индекс вместо полного пути
+        persona_id=persona_id,  # ID стабилен при пересортировке списка
     )
     
-    # Логика кэширования: сначала пробуем использовать file_id (Telegram не скачивает файл)
-    # Если file_id невалиден - загружаем файл и обновляем file_id
     photo_file_id = persona.get("photo_file_id")
-    photo_path = persona['photo']
-    sent_message = None
+
+    # Если карточка уже на экране и file_id есть в кэше - редактируем сообщение
+    # на месте: один запрос к API вместо удаления старого и отправки нового
+    if edit_target is not None and photo_file_id and photo_file_id.strip():
+        try:
+            sent_message = await edit_target.edit_media(
+                InputMediaPhoto(media=photo_file_id, caption=text, parse_mode='HTML'),
+                reply_markup=markup,
+            )
+            await state.update_data(
+                person_index=index,
+                last_photo_message_id=sent_message.message_id,
+                last_photo_chat_id=sent_message.chat.id,
+            )
+            return
+        except Exception as e:
+            logger.warning(f"Не удалось отредактировать карточку persona_id={persona_id}, отправляем заново: {e}")
+
+    target = receiver if isinstance(receiver, Message) else receiver.message
+    sent_message = await send_persona_photo(target, persona, text, markup=markup)
     
-    # Проверяем, что photo_file_id не пустой и не None
-    if photo_file_id and photo_file_id.strip():
-        # Пробуем использовать кэшированный file_id - Telegram НЕ будет скачивать файл
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.info(f"Используем кэшированный file_id для persona_id={persona_id}: {photo_file_id[:20]}...")
+    # Сохраняем индекс и ID сообщения с фото (для удаления) одной записью в FSM
+    await state.update_data(
+        person_index=index,
+        last_photo_message_id=sent_message.message_id if sent_message else None,
+        last_photo_chat_id=sent_message.chat.id if sent_message else None,
+    )
+
+    # Редактирование не удалось и карточка отправлена заново - убираем старую
+    if edit_target is not None:
         try:
-            if isinstance(receiver, Message):
-                sent_message = await receiver.answer_photo(
-                    photo_file_id,  # Передаем file_id как строку - Telegram использует кэш
-                    caption=text,
-                    parse_mode='HTML',
-                    reply_markup=markup
-                )
+            await edit_target.delete()
+        except Exception:
+            pass
+
+
+# Прогрев file_id соседних карточек: первая отправка фото персонажа - это
+# полная загрузка файла в Telegram. Если задан служебный чат CACHE_CHAT_ID,
+# фото следующих персонажей заранее отправляются туда, file_id сохраняется,
+# а временное сообщение удаляется - стрелки листаются без холодных загрузок.
+CACHE_CHAT_ID = os.getenv("CACHE_CHAT_ID")
+WARM_AHEAD = 2  # Сколько следующих карточек прогревать
+
+
+async def _warm_next(profiles, index, bot: Bot):
+    if not CACHE_CHAT_ID or not profiles:
+        return
+    for offset in range(1, WARM_AHEAD + 1):
+        persona = profiles[(index + offset) % len(profiles)]
+        persona_id = persona.get("id")
+        photo_path = persona.get("photo")
+        file_id = persona.get("photo_file_id")
+        if not persona_id or not photo_path or (file_id and file_id.strip()):
+            continue
+        try:
+            if photo_path.startswith(("http://", "https://")):
+                photo = URLInputFile(photo_path)
             else:
-                sent_message = await receiver.message.answer_photo(
-                    photo_file_id,  # Передаем file_id как строку - Telegram использует кэш
-                    caption=text,
-                    parse_mode='HTML',
-                    reply_markup=markup
-                )
-            # file_id работает - файл НЕ скачивался, используем кэш Telegram
-            logger.info(f"Успешно использован file_id для persona_id={persona_id}, файл НЕ скачивался")
+                photo = FSInputFile(photo_path)
+            sent = await bot.send_photo(CACHE_CHAT_ID, photo)
+            if sent.photo:
+                new_file_id = sent.photo[-1].file_id
+                await asyncio.to_thread(update_persona, persona_id, photo_file_id=new_file_id)
+                update_cached_persona(persona_id, photo_file_id=new_file_id)
+            try:
+                await bot.delete_message(CACHE_CHAT_ID, sent.message_id)
+            except Exception:
+                pass
         except Exception as e:
-            # file_id невалиден (истек срок действия или файл удален) - загружаем файл
-            logger.warning(f"file_id невалиден для persona_id={persona_id}, загружаем файл: {e}")
-            photo_file_id = None  # Сбрасываем невалидный file_id
-    else:
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.info(f"file_id отсутствует для persona_id={persona_id}, будет загружен файл")
-    
-    if not photo_file_id or not sent_message:
-        # Первая отправка или file_id невалиден - загружаем файл
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.info(f"Загружаем файл для persona_id={persona_id} из {photo_path[:50]}...")
-        if photo_path.startswith("http://") or photo_path.startswith("https://"):
-            photo = URLInputFile(photo_path)
-        else:
-            photo = FSInputFile(photo_path)
-        
-        # Отправляем фото (Telegram скачивает файл)
-        if isinstance(receiver, Message):
-            sent_message = await receiver.answer_photo(photo, caption=text, parse_mode='HTML', reply_markup=markup)
-        else:
-            sent_message = await receiver.message.answer_photo(photo, caption=text, parse_mode='HTML', reply_markup=markup)
-        
-        # Сохраняем file_id в БД для последующих отправок
-        if persona_id and sent_message.photo:
-            # Берем самое большое фото (последнее в массиве)
-            new_file_id = sent_message.photo[-1].file_id
-            logger.info(f"Сохраняем новый file_id для persona_id={persona_id}: {new_file_id[:20]}...")
-            update_persona(persona_id, photo_file_id=new_file_id)
-            # Обновляем кэш
-            invalidate_cache()
-    
-    # Сохраняем ID сообщения с фото для последующего удаления
-    if sent_message:
-        await state.update_data(
-            person_index=index,
-            last_photo_message_id=sent_message.message_id,
-            last_photo_chat_id=sent_message.chat.id
-        )
-    else:
-        await state.update_data(person_index=index)
+            logger.debug(f"Не удалось прогреть фото persona_id={persona_id}: {e}")
+
 
 async def popular_menu_handler(msg: Message | CallbackQuery, state: FSMContext, bot: Bot):
     """Обработчик кнопки 'Популярные Персонажи'."""
@@ -265,7 +325,9 @@ async def popular_menu_handler(msg: Message | CallbackQuery, state: FSMContext,
         "⭐ Популярные Персонажи",
         reply_markup=get_reply_characters_menu(),
     )
-    await send_person_card(0, receiver, state, bot, no_prev=True)
+    await send_person_card(0, receiver, state, bot, no_prev=True, profiles=profiles)
+    # Прогреваем фото следующих карточек в фоне
+    spawn(_warm_next(profiles, 0, bot))
 
 async def back_menu_handler(msg: Message, state: FSMContext, bot: Bot):
     await deactivate_persona_chat(state)
@@ -275,77 +337,57 @@ async def back_menu_handler(msg: Message, state: FSMContext, bot: Bot):
 # --- CALLBACK HANDLERS ---
 async def character_next_callback(call: CallbackQuery, state: FSMContext, bot: Bot):
     # Отвечаем на callback query сразу, чтобы избежать ошибки "query is too old"
-    try:
-        await call.answer()
-    except Exception:
-        pass  # Игнорируем ошибки, если callback уже устарел
+    await safe_answer(call)
     
     await deactivate_persona_chat(state)
-    # Удаляем предыдущее сообщение с фото
-    await _delete_last_photo_message(state, bot)
     profiles = list_profiles()
     data = await state.get_data()
     idx = data.get("person_index", 0)
     idx = (idx + 1) % len(profiles)
-    await send_person_card(idx, call, state, bot)
-    try:
-        await call.message.delete()
-    except Exception:
-        pass
+    # Редактируем карточку на месте; удаление+переотправка остаются
+    # только как фолбэк при отсутствующем/невалидном file_id
+    await send_person_card(idx, call, state, bot, profiles=profiles, edit_target=call.message)
+    spawn(_warm_next(profiles, idx, bot))
 
 async def character_prev_callback(call: CallbackQuery, state: FSMContext, bot: Bot):
     # Отвечаем на callback query сразу, чтобы избежать ошибки "query is too old"
-    try:
-        await call.answer()
-    except Exception:
-        pass  # Игнорируем ошибки, если callback уже устарел
+    await safe_answer(call)
     
     await deactivate_persona_chat(state)
-    # Удаляем предыдущее сообщение с фото
-    await _delete_last_photo_message(state, bot)
     profiles = list_profiles()
     data = await state.get_data()
     idx = data.get("person_index", 0)
     idx = (idx - 1 + len(profiles)) % len(profiles)
-    await send_person_card(idx, call, state, bot)
-    try:
-        await call.message.delete()
-    except Exception:
-        pass
+    # Редактируем карточку на месте (фолбэк - удаление и переотправка)
+    await send_person_card(idx, call, state, bot, profiles=profiles, edit_target=call.message)
+    spawn(_warm_next(profiles, idx, bot))
 
 
 async def character_delete_callback(call: CallbackQuery, state: FSMContext, bot: Bot):
     # Отвечаем на callback query сразу, чтобы избежать ошибки "query is too old"
-    try:
-        await call.answer()
-    except Exception:
-        pass  # Игнорируем ошибки, если callback уже устарел
+    await safe_answer(call)
     
     await deactivate_persona_chat(state)
     if not is_admin(call.from_user.id):
         await call.message.answer("Недостаточно прав для удаления.")
         return
-    parts = (call.data or "").split(":", 2)
-    try:
-        person_index = int(parts[2]) if len(parts) > 2 else None
-    except (ValueError, IndexError):
+    # Суффикс после последнего ':' - ID персонажа; проверка isdigit
+    # не платит за исключение и traceback на кривом callback_data
+    pid_s = (call.data or "").rsplit(":", 1)[-1]
+    if not pid_s.isdigit():
         await call.message.answer("Не удалось определить анкету.")
         return
+    persona_id = int(pid_s)
     
-    profiles = list_profiles()
-    if person_index is None or person_index < 0 or person_index >= len(profiles):
+    if get_cached_persona(persona_id) is None:
         await call.message.answer("Персонаж не найден.")
         return
     
-    persona_id = profiles[person_index].get("id")
-    if not persona_id:
-        await call.message.answer("Не удалось определить анкету.")
-        return
-    
-    # Удаляем предыдущее сообщение с фото перед удалением персонажа
-    await _delete_last_photo_message(state, bot)
-    
-    deleted = await delete_persona(persona_id)
+    # Удаляем предыдущее сообщение с фото параллельно с удалением персонажа
+    _, deleted = await asyncio.gather(
+        _delete_last_photo_message(state, bot),
+        delete_persona(persona_id),
+    )
     if deleted:
         await call.message.answer("✅ Анкета удалена.")
         # Кэш уже очищен в delete_persona, но на всякий случай обновляем
@@ -362,7 +404,7 @@ async def character_delete_callback(call: CallbackQuery, state: FSMContext, bot:
     idx = data.get("person_index", 0)
     if idx >= len(profiles):
         idx = 0
-    await send_person_card(idx, call, state, bot)
+    await send_person_card(idx, call, state, bot, profiles=profiles)
     try:
         await call.message.delete()
     except Exception:
@@ -375,49 +417,31 @@ async def character_backmain_callback(call: CallbackQuery, state: FSMContext):
 
 async def character_startchat_callback(call: CallbackQuery, state: FSMContext, bot: Bot):
     # Отвечаем на callback query сразу, чтобы избежать ошибки "query is too old"
-    try:
-        await call.answer("Запускаю чат...")
-    except Exception:
-        pass  # Игнорируем ошибки, если callback уже устарел
+    await safe_answer(call, "Запускаю чат...")
     
     # Удаляем последнее сообщение с фото перед началом чата
     await _delete_last_photo_message(state, bot)
     
-    parts = (call.data or "").split(":", 2)
-    try:
-        person_index = int(parts[2]) if len(parts) > 2 else None
-    except (ValueError, IndexError):
+    # Суффикс после последнего ':' - ID персонажа (без split-списка и try/except)
+    pid_s = (call.data or "").rsplit(":", 1)[-1]
+    if not pid_s.isdigit():
         await call.message.answer("Не удалось определить анкету.")
         return
     
-    profiles = list_profiles()
-    if person_index is None or person_index < 0 or person_index >= len(profiles):
+    # O(1) поиск по индексу кэша вместо обращения по позиции в списке,
+    # которая могла сдвинуться после пересортировки по популярности
+    persona = get_cached_persona(int(pid_s))
+    if persona is None:
         await call.message.answer("Персонаж не найден.")
         return
     
-    persona = profiles[person_index]
-    
     # Проверяем баланс токенов перед началом чата
     user_id = call.from_user.id
     
-    # Проверяем безлимитный премиум (тариф 4)
-    try:
-        from premium.subscription import is_premium_unlimited
-        if is_premium_unlimited(user_id):
-            # Безлимитный премиум - можно начинать чат
-            pass  # Продолжаем дальше
-        else:
-            # Обычная проверка баланса
-            balance = get_token_balance(user_id)
-            if balance <= 0:
-                await call.message.answer(
-                    f"❗️ Недостаточно токенов для начала чата. Баланс: {balance}.\n\n"
-                    "Нажми «💰 Пополнить баланс» или используй команду /topup.",
-                )
-                return
-    except Exception:
-        # При ошибке проверяем токены как обычно
-        balance = get_token_balance(user_id)
+    # Проверяем безлимитный премиум (тариф 4); при ошибке кэш вернет
+    # неактивный статус и сработает обычная проверка баланса
+    if not get_premium_info(user_id).unlimited:
+        balance = get_balance_cached(user_id)
         if balance <= 0:
             await call.message.answer(
                 f"❗️ Недостаточно токенов для начала чата. Баланс: {balance}.\n\n"
@@ -425,113 +449,76 @@ async def character_startchat_callback(call: CallbackQuery, state: FSMContext, b
             )
             return
     
-    # Увеличиваем счетчик популярности (количество запросов)
+    # Увеличиваем счетчик популярности (количество запросов) в фоне:
+    # это аналитика, пользователь не должен ждать записи в БД
     persona_id = persona.get("id")
     if persona_id:
-        increment_persona_chat_count(persona_id)
-        # Очищаем кэш, чтобы обновить порядок популярности
-        invalidate_cache()
+        spawn(asyncio.to_thread(increment_persona_chat_count, persona_id))
+        # Бампаем счетчик в кэше вместо полного сброса; порядок
+        # по популярности пересчитается лениво при следующем чтении
+        bump_popularity(persona_id)
     
-    # Очищаем состояние wizard, если оно активно, чтобы избежать конфликтов
+    # Очищаем состояние wizard (если оно активно) и включаем чат
+    # одной записью в FSM-хранилище вместо двух
     data = await state.get_data()
+    updates = {}
     if data.get("wizard_draft") or data.get("wizard_editing"):
-        await state.update_data(wizard_draft=None, wizard_editing=None)
+        updates["wizard_draft"] = None
+        updates["wizard_editing"] = None
     context = start_persona_chat(persona, user_id)
     intro_text = build_persona_intro(persona)
     if intro_text:
         history = context.history or []
         history.append({"role": "assistant", "content": intro_text})
         context.history = history
-    await state.update_data(
-        persona_chat_context=context.to_dict(),
-        persona_chat_active=True,
-    )
+    updates["persona_chat_context"] = context.to_dict()
+    updates["persona_chat_active"] = True
+    await state.update_data(**updates)
     # Форматируем intro для отображения
     persona_name = persona.get("name", "Персонаж")
     formatted_intro = format_persona_response(intro_text, persona_name)
-    # Логика кэширования: сначала пробуем использовать file_id (Telegram не скачивает файл)
-    # Если file_id невалиден - загружаем файл и обновляем file_id
-    photo_file_id = persona.get("photo_file_id")
-    photo_path = persona.get("photo")
-    persona_id = persona.get("id")
-    sent_message = None
-    
-    # Проверяем, что photo_file_id не пустой и не None
-    if photo_file_id and photo_file_id.strip():
-        # Пробуем использовать кэшированный file_id - Telegram НЕ будет скачивать файл
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.info(f"Используем кэшированный file_id для persona_id={persona_id}: {photo_file_id[:20]}...")
-        try:
-            sent_message = await call.message.answer_photo(
-                photo_file_id,  # Передаем file_id как строку - Telegram использует кэш
-                caption=formatted_intro,
-                parse_mode="HTML",
-            )
-            # file_id работает - файл НЕ скачивался, используем кэш Telegram
-            logger.info(f"Успешно использован file_id для persona_id={persona_id}, файл НЕ скачивался")
-        except Exception as e:
-            # file_id невалиден (истек срок действия или файл удален) - загружаем файл
-            logger.warning(f"file_id невалиден для persona_id={persona_id}, загружаем файл: {e}")
-            photo_file_id = None  # Сбрасываем невалидный file_id
-    else:
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.info(f"file_id отсутствует для persona_id={persona_id}, будет загружен файл")
-    
-    if not photo_file_id or not sent_message:
-        # Первая отправка или file_id невалиден - загружаем файл
-        if photo_path:
-            try:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.info(f"Загружаем файл для persona_id={persona_id} из {photo_path[:50]}...")
-                if photo_path.startswith("http://") or photo_path.startswith("https://"):
-                    photo = URLInputFile(photo_path)
-                else:
-                    photo = FSInputFile(photo_path)
-                sent_message = await call.message.answer_photo(
-                    photo,  # Telegram скачивает файл
-                    caption=formatted_intro,
-                    parse_mode="HTML",
-                )
-                # Сохраняем file_id в БД для последующих отправок
-                if persona_id and sent_message.photo:
-                    new_file_id = sent_message.photo[-1].file_id
-                    logger.info(f"Сохраняем новый file_id для persona_id={persona_id}: {new_file_id[:20]}...")
-                    update_persona(persona_id, photo_file_id=new_file_id)
-                    invalidate_cache()
-            except Exception:
-                await call.message.answer(formatted_intro, parse_mode="HTML")
-        else:
-            await call.message.answer(formatted_intro, parse_mode="HTML")
+    # Отправляем intro с фото персонажа; при любой проблеме с фото
+    # показываем intro обычным текстом
+    try:
+        sent_message = await send_persona_photo(call.message, persona, formatted_intro)
+    except Exception:
+        sent_message = None
+    if sent_message is None:
+        await call.message.answer(formatted_intro, parse_mode="HTML")
+
+# Текстовые кнопки меню: один обработчик со словарем вместо отдельного
+# фильтра на каждую кнопку - O(1) поиск при любом числе кнопок
+TEXT_HANDLERS = {
+    "✨ Профиль": profile_menu_handler,
+    "⭐ Популярные Персонажи": popular_menu_handler,
+    "🏡 Menu": back_menu_handler,
+}
+
+
+async def _text_menu_router(msg: Message, state: FSMContext, bot: Bot):
+    handler = TEXT_HANDLERS.get(msg.text)
+    if handler:
+        await handler(msg, state, bot)
+
 
 def register_menu_handlers(dp: Dispatcher):
     """
     Регистрирует хэндлеры главного меню.
     """
     # Обработчики текстовых кнопок
-    dp.message.register(profile_menu_handler, lambda m: m.text == "✨ Профиль")
-    dp.message.register(popular_menu_handler, lambda m: m.text == "⭐ Популярные Персонажи")
-    dp.message.register(back_menu_handler, lambda m: m.text == "🏡 Menu")
+    dp.message.register(_text_menu_router, F.text.in_(frozenset(TEXT_HANDLERS)))
     
     # Обработчики inline кнопок главного меню
-    dp.callback_query.register(
-        profile_menu_handler, 
-        lambda c: c.data == "menu:profile"
-    )
-    dp.callback_query.register(
-        popular_menu_handler, 
-        lambda c: c.data == "menu:popular"
-    )
+    dp.callback_query.register(profile_menu_handler, F.data == "menu:profile")
+    dp.callback_query.register(popular_menu_handler, F.data == "menu:popular")
     # menu:mychars обрабатывается в register_my_char_handlers
     
     # Callback'и для анкеты популярных персонажей
-    dp.callback_query.register(character_next_callback, lambda c: c.data == "character:next")
-    dp.callback_query.register(character_prev_callback, lambda c: c.data == "character:prev")
-    dp.callback_query.register(character_delete_callback, lambda c: c.data and c.data.startswith("character:delete:"))
-    dp.callback_query.register(character_startchat_callback, lambda c: c.data and c.data.startswith("character:startchat:"))
-    dp.callback_query.register(character_backmain_callback, lambda c: c.data == "character:backmain")
+    dp.callback_query.register(character_next_callback, F.data == "character:next")
+    dp.callback_query.register(character_prev_callback, F.data == "character:prev")
+    dp.callback_query.register(character_delete_callback, F.data.startswith("character:delete:"))
+    dp.callback_query.register(character_startchat_callback, F.data.startswith("character:startchat:"))
+    dp.callback_query.register(character_backmain_callback, F.data == "character:backmain")
     
     # Регистрация обработчиков "Мои персонажи"
     register_my_char_handlers(dp)
@@ -3,6 +3,8 @@
 Все функции — только создание клавиатур.
 """
 
+from functools import lru_cache
+
 from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
@@ -12,43 +14,84 @@ from aiogram.types import (
 
 from refferals.constants import REFERRAL_BUTTON_TEXT
 
+# Статичные клавиатуры строятся один раз при импорте модуля: их содержимое
+# неизменно, а создание pydantic-моделей на каждое сообщение не бесплатно.
+# aiogram лишь сериализует reply_markup при отправке и не мутирует объект,
+# поэтому общий экземпляр безопасен.
+
+_GENDER_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="👨 Парень", callback_data="gender:guy"),
+            InlineKeyboardButton(text="👩 Девушка", callback_data="gender:girl"),
+        ]
+    ]
+)
+
+_MAIN_MENU_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="⭐ Популярные Персонажи", callback_data="menu:popular"),
+            InlineKeyboardButton(text="💎 Мои персонажи", callback_data="menu:mychars"),
+        ],
+        [
+            InlineKeyboardButton(text="✨ Профиль", callback_data="menu:profile"),
+        ],
+        [
+            InlineKeyboardButton(text=REFERRAL_BUTTON_TEXT, callback_data="menu:referrals"),
+        ],
+    ]
+)
+
+_REPLY_MAIN_MENU = ReplyKeyboardMarkup(
+    keyboard=[
+        [
+            KeyboardButton(text="⭐ Популярные Персонажи"),
+            KeyboardButton(text="💎 Мои персонажи"),
+        ],
+        [
+            KeyboardButton(text="✨ Профиль"),
+        ],
+        [KeyboardButton(text="💰 Пополнить баланс")],
+        [KeyboardButton(text=REFERRAL_BUTTON_TEXT)],
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=False,
+)
+
+_REPLY_SECTION_MENU = ReplyKeyboardMarkup(
+    keyboard=[
+        [
+            KeyboardButton(text="⭐ Популярные Персонажи"),
+            KeyboardButton(text="💎 Мои персонажи"),
+        ],
+        [
+            KeyboardButton(text="✨ Профиль"),
+        ],
+        [KeyboardButton(text="💰 Пополнить баланс")],
+        [KeyboardButton(text="🏡 Menu")],
+        [KeyboardButton(text=REFERRAL_BUTTON_TEXT)],
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=False,
+)
+
+
 def get_gender_keyboard() -> InlineKeyboardMarkup:
     """
-    Создает клавиатуру для выбора пола пользователя.
+    Клавиатура для выбора пола пользователя.
 
     Returns:
         InlineKeyboardMarkup: Клавиатура с кнопками "Парень" и "Девушка"
     """
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="👨 Парень", callback_data="gender:guy"),
-                InlineKeyboardButton(text="👩 Девушка", callback_data="gender:girl"),
-            ]
-        ]
-    )
-    return keyboard
+    return _GENDER_KEYBOARD
 
 def get_main_menu_keyboard() -> InlineKeyboardMarkup:
     """
     Главная клавиатура после выбора пола пользователя.
     Содержит кнопки: Профиль, Мои персонажи, Популярные Персонажи.
     """
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="⭐ Популярные Персонажи", callback_data="menu:popular"),
-                InlineKeyboardButton(text="💎 Мои персонажи", callback_data="menu:mychars"),
-            ],
-            [
-                InlineKeyboardButton(text="✨ Профиль", callback_data="menu:profile"),
-            ],
-            [
-                InlineKeyboardButton(text=REFERRAL_BUTTON_TEXT, callback_data="menu:referrals"),
-            ],
-        ]
-    )
-    return keyboard
+    return _MAIN_MENU_KEYBOARD
 
 def get_reply_main_menu() -> ReplyKeyboardMarkup:
     """
@@ -56,100 +99,101 @@ def get_reply_main_menu() -> ReplyKeyboardMarkup:
     Популярные Персонажи на весь тачпад (верхний ряд).
     Мои персонажи по середине, чуть ниже.
     """
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [
-                KeyboardButton(text="⭐ Популярные Персонажи"),
-                KeyboardButton(text="💎 Мои персонажи"),
-            ],
-            [
-                KeyboardButton(text="✨ Профиль"),
-            ],
-            [KeyboardButton(text="💰 Пополнить баланс")],
-            [KeyboardButton(text=REFERRAL_BUTTON_TEXT)],
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=False,
-    )
+    return _REPLY_MAIN_MENU
 
 def get_reply_characters_menu() -> ReplyKeyboardMarkup:
     """
     Меню, когда пользователь находится в разделе популярных персонажей.
+    Совпадает с меню разделов (та же раскладка кнопок).
     """
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [
-                KeyboardButton(text="⭐ Популярные Персонажи"),
-                KeyboardButton(text="💎 Мои персонажи"),
-            ],
-            [
-                KeyboardButton(text="✨ Профиль"),
-            ],
-            [KeyboardButton(text="💰 Пополнить баланс")],
-            [KeyboardButton(text="🏡 Menu")],
-            [KeyboardButton(text=REFERRAL_BUTTON_TEXT)],
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=False,
-    )
+    return _REPLY_SECTION_MENU
 
 def get_reply_section_menu() -> ReplyKeyboardMarkup:
     """
     Клавиатура для разделов профиля/персонажей/популярного — с кнопкой "Назад".
     """
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [
-                KeyboardButton(text="⭐ Популярные Персонажи"),
-                KeyboardButton(text="💎 Мои персонажи"),
-            ],
-            [
-                KeyboardButton(text="✨ Профиль"),
-            ],
-            [KeyboardButton(text="💰 Пополнить баланс")],
-            [KeyboardButton(text="🏡 Menu")],
-            [KeyboardButton(text=REFERRAL_BUTTON_TEXT)],
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=False,
+    return _REPLY_SECTION_MENU
+
+# Навигационные кнопки карточек не зависят от параметров — создаем их один
+# раз, а кнопки с ID персонажа в callback_data мемоизируем по ID, чтобы при
+# промахе кэша markup-а не форматировать f-строки и не гонять pydantic заново.
+_BTN_PREV_CHAR = InlineKeyboardButton(text="⬅️ Назад", callback_data="character:prev")
+_BTN_NEXT_CHAR = InlineKeyboardButton(text="Далее ⏩", callback_data="character:next")
+_BTN_PREV_MY = InlineKeyboardButton(text="⬅️ Назад", callback_data="mychar:prev")
+_BTN_NEXT_MY = InlineKeyboardButton(text="Далее ⏩", callback_data="mychar:next")
+_BTN_PUBLISHED = InlineKeyboardButton(
+    text="✅ Уже опубликован", callback_data="mychar:published"
+)
+
+
+@lru_cache(maxsize=2048)
+def _startchat_btn(persona_id: int) -> InlineKeyboardButton:
+    return InlineKeyboardButton(
+        text="💭 Начать чат", callback_data=f"character:startchat:{persona_id}"
     )
 
+
+@lru_cache(maxsize=2048)
+def _delete_char_btn(persona_id: int) -> InlineKeyboardButton:
+    return InlineKeyboardButton(
+        text="🗑️ Удалить", callback_data=f"character:delete:{persona_id}"
+    )
+
+
+@lru_cache(maxsize=2048)
+def _publish_btn(persona_id: int) -> InlineKeyboardButton:
+    return InlineKeyboardButton(
+        text="📣 Опубликовать", callback_data=f"mychar:publish:{persona_id}"
+    )
+
+
+@lru_cache(maxsize=2048)
+def _edit_desc_btn(persona_id: int) -> InlineKeyboardButton:
+    return InlineKeyboardButton(
+        text="✏️ Редактировать описание",
+        callback_data=f"mychar:edit_description:{persona_id}",
+    )
+
+
+@lru_cache(maxsize=2048)
+def _delete_my_btn(persona_id: int) -> InlineKeyboardButton:
+    return InlineKeyboardButton(
+        text="🗑️ Удалить персонажа",
+        callback_data=f"mychar:delete:{persona_id}",
+    )
+
+
+# Параметры карточных клавиатур имеют низкую кардинальность (флаги + ID),
+# а сборка пересоздает кнопки с pydantic-валидацией на каждое перелистывание.
+# lru_cache возвращает готовый markup; экземпляры разделяемые и read-only
+# (aiogram только сериализует их при отправке).
+@lru_cache(maxsize=1024)
 def get_person_card_keyboard(
     no_prev: bool = False,
     module_file: str | None = None,
     can_delete: bool = False,
     can_chat: bool = False,
-    person_index: int | None = None,
+    persona_id: int | None = None,
 ) -> InlineKeyboardMarkup:
     """
     Клавиатура для общей анкеты: навигация и, при необходимости, кнопка удаления.
-    Использует индекс персонажа вместо полного пути для избежания превышения лимита callback_data.
+    В callback_data передается ID персонажа: он стабилен, в отличие от индекса,
+    который сдвигается при пересортировке списка по популярности.
     """
     rows: list[list[InlineKeyboardButton]] = []
     nav_row: list[InlineKeyboardButton] = []
     if not no_prev:
-        nav_row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data="character:prev"))
-    nav_row.append(InlineKeyboardButton(text="Далее ⏩", callback_data="character:next"))
+        nav_row.append(_BTN_PREV_CHAR)
+    nav_row.append(_BTN_NEXT_CHAR)
     rows.append(nav_row)
-    if can_chat and person_index is not None:
-        rows.append(
-            [
-                InlineKeyboardButton(
-                    text="💭 Начать чат", callback_data=f"character:startchat:{person_index}"
-                )
-            ]
-        )
-    if can_delete and person_index is not None:
-        rows.append(
-            [
-                InlineKeyboardButton(
-                    text="🗑️ Удалить", callback_data=f"character:delete:{person_index}"
-                )
-            ]
-        )
+    if can_chat and persona_id is not None:
+        rows.append([_startchat_btn(persona_id)])
+    if can_delete and persona_id is not None:
+        rows.append([_delete_char_btn(persona_id)])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+@lru_cache(maxsize=2)
 def get_reply_my_characters_menu(is_premium: bool = False) -> ReplyKeyboardMarkup:
     """
     Меню при просмотре своих персонажей.
@@ -181,6 +225,7 @@ def get_reply_my_characters_menu(is_premium: bool = False) -> ReplyKeyboardMarku
         one_time_keyboard=False,
     )
 
+@lru_cache(maxsize=1024)
 def get_my_person_card_keyboard(
     no_prev: bool = False,
     noop: bool = False,
@@ -194,46 +239,19 @@ def get_my_person_card_keyboard(
     rows: list[list[InlineKeyboardButton]] = []
     nav_row: list[InlineKeyboardButton] = []
     if not noop and not no_prev:
-        nav_row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data="mychar:prev"))
+        nav_row.append(_BTN_PREV_MY)
     if not noop:
-        nav_row.append(InlineKeyboardButton(text="Далее ⏩", callback_data="mychar:next"))
+        nav_row.append(_BTN_NEXT_MY)
     if nav_row:
         rows.append(nav_row)
     if can_publish and persona_id is not None:
-        rows.append(
-            [
-                InlineKeyboardButton(
-                    text="📣 Опубликовать",
-                    callback_data=f"mychar:publish:{persona_id}",
-                )
-            ]
-        )
+        rows.append([_publish_btn(persona_id)])
     elif published:
-        rows.append(
-            [
-                InlineKeyboardButton(
-                    text="✅ Уже опубликован", callback_data="mychar:published"
-                )
-            ]
-        )
+        rows.append([_BTN_PUBLISHED])
     # Кнопка редактирования описания
     if persona_id is not None:
-        rows.append(
-            [
-                InlineKeyboardButton(
-                    text="✏️ Редактировать описание",
-                    callback_data=f"mychar:edit_description:{persona_id}",
-                )
-            ]
-        )
+        rows.append([_edit_desc_btn(persona_id)])
     # Кнопка удаления персонажа
     if persona_id is not None:
-        rows.append(
-            [
-                InlineKeyboardButton(
-                    text="🗑️ Удалить персонажа",
-                    callback_data=f"mychar:delete:{persona_id}",
-                )
-            ]
-        )
+        rows.append([_delete_my_btn(persona_id)])
     return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -5,42 +5,69 @@
 
 from __future__ import annotations
 
-from datetime import datetime
 import logging
 
 from SMS.database import get_db_connection, init_database
 
 logger = logging.getLogger(__name__)
 
+# init_database() только выполняет CREATE TABLE IF NOT EXISTS, но это все равно
+# лишний round-trip в SQLite на каждое чтение/запись профиля. Достаточно
+# прогнать инициализацию один раз на процесс.
+_db_inited = False
+
+
+def _ensure_db() -> None:
+    global _db_inited
+    if not _db_inited:
+        init_database()
+        _db_inited = True
+
+
+# Дата регистрации неизменна после первой записи, поэтому ее можно
+# мемоизировать в процессе и не ходить в SQLite на каждое чтение.
+_reg_date_cache: dict[int, str] = {}
+
 
 def set_registration_date(user_id: int) -> None:
     """Устанавливает дату регистрации пользователя."""
-    init_database()
-    
+    _ensure_db()
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        reg_date = datetime.now().strftime('%d.%m.%Y %H:%M')
+        # Дату форматирует сама SQLite: один параметр вместо strftime в Python,
+        # а RETURNING отдает фактическое значение (старое при конфликте).
         cursor.execute(
             """
             INSERT INTO user_profiles (user_id, reg_date, updated_at)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
+            VALUES (?, strftime('%d.%m.%Y %H:%M', 'now', 'localtime'), CURRENT_TIMESTAMP)
             ON CONFLICT(user_id) DO UPDATE SET
-                reg_date = COALESCE(reg_date, ?),
+                reg_date = COALESCE(reg_date, excluded.reg_date),
                 updated_at = CURRENT_TIMESTAMP
+            RETURNING reg_date
             """,
-            (user_id, reg_date, reg_date)
+            (user_id,)
         )
+        row = cursor.fetchone()
+        reg_date = row["reg_date"] if row else None
+        if reg_date:
+            _reg_date_cache[user_id] = reg_date
         logger.info(f"Установлена дата регистрации для user_id={user_id}: {reg_date}")
 
 
 def get_registration_date(user_id: int) -> str | None:
     """Получает дату регистрации пользователя."""
-    init_database()
-    
+    cached = _reg_date_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    _ensure_db()
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT reg_date FROM user_profiles WHERE user_id = ?", (user_id,))
         row = cursor.fetchone()
-        if row:
+        if row and row["reg_date"]:
+            _reg_date_cache[user_id] = row["reg_date"]
             return row["reg_date"]
         return None
@@ -10,6 +10,13 @@ import os
 from aiogram import Bot, Dispatcher
 from dotenv import load_dotenv
 
+# Опционально используем uvloop: C-реализация event loop снижает накладные
+# расходы на разбор и диспетчеризацию каждого апдейта при long polling
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 from knops.handlers_gender import register_gender_handlers
 from knops.handlers_menu import register_menu_handlers
 from createpers.handlers_wizard import register_wizard_handlers
@@ -20,6 +27,19 @@ from premium.handlers import register_premium_handlers
 from refferals import register_referral_handlers, init_referrals
 from refferals.constants import set_bot_username
 
+# Единая таблица регистраторов: порядок важен (первые роутеры имеют приоритет
+# при совпадении фильтров), а один цикл вместо семи вызовов упрощает
+# добавление/отключение модулей.
+_REGISTRARS = (
+    register_gender_handlers,
+    register_menu_handlers,
+    register_payment_handlers,
+    register_chat_handlers,
+    register_wizard_handlers,
+    register_premium_handlers,
+    register_referral_handlers,
+)
+
 
 async def _start_bot() -> None:
     load_dotenv()
@@ -62,28 +82,15 @@ async def _start_bot() -> None:
         logging.warning(f"Не удалось инициализировать реферальную систему: {e}")
         # Продолжаем работу даже если не удалось получить username бота
 
-    register_gender_handlers(dp)
-    register_menu_handlers(dp)
-    register_payment_handlers(dp)
-    register_chat_handlers(dp)
-    register_wizard_handlers(dp)
-    register_premium_handlers(dp)
-    register_referral_handlers(dp)
+    for register in _REGISTRARS:
+        register(dp)
 
     # Запускаем синхронизатор оплаты в Telegram Stars (опционально, если используется внешний API)
     stars_task = start_stars_sync(bot)
     
     # Очищаем временные файлы в облаке при старте бота (в фоне, не блокируем запуск)
-    async def cleanup_on_start():
-        try:
-            from pers.storage import cleanup_temp_files_yandex
-            deleted = await cleanup_temp_files_yandex()
-            if deleted > 0:
-                logging.info(f"Очищено {deleted} временных файлов в облаке при старте")
-        except Exception as e:
-            logging.debug(f"Не удалось очистить временные файлы при старте: {e}")
-    
-    asyncio.create_task(cleanup_on_start())
+    from pers.db_sync import cleanup_temp_files_on_start
+    asyncio.create_task(cleanup_temp_files_on_start())
     
     logging.info("Бот запущен")
     try:
@@ -93,6 +100,13 @@ async def _start_bot() -> None:
     except Exception as e:
         logging.error(f"Ошибка при работе бота: {e}", exc_info=True)
     finally:
+        # Дожидаемся фоновых задач (счетчики популярности, дата регистрации)
+        try:
+            from knops.background import wait_all
+            await wait_all()
+        except Exception as e:
+            logging.warning(f"Не удалось дождаться фоновых задач: {e}")
+        
         # Сохранение БД в облако при остановке
         try:
             from pers.db_sync import sync_databases_to_cloud_async
@@ -104,7 +118,14 @@ async def _start_bot() -> None:
             stars_task.cancel()
             with contextlib.suppress(asyncio.CancelledError):
                 await stars_task
-        
+
+        # Закрываем общий HTTP-клиент Tribute API
+        try:
+            from payments.tribute_api import aclose_client
+            await aclose_client()
+        except Exception as e:
+            logging.warning(f"Ошибка при закрытии Tribute HTTP-клиента: {e}")
+
         # Закрываем сессию бота
         try:
             await bot.session.close()
@@ -114,6 +135,8 @@ async def _start_bot() -> None:
 
 
 def main():
+    if uvloop is not None:
+        uvloop.install()
     asyncio.run(_start_bot())
 
 
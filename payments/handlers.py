@@ -4,39 +4,115 @@
 
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 
-from aiogram import Bot, Dispatcher
+# Опционально используем orjson: C-сериализатор заметно быстрее стандартного
+# json на горячем пути платежей (pre-checkout надо ответить за ~10 секунд).
+try:
+    import orjson
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    _dumps = json.dumps
+    _loads = json.loads
+
+from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command
-from aiogram.types import CallbackQuery, LabeledPrice, Message, PreCheckoutQuery
-from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.types import (
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    Message,
+    PreCheckoutQuery,
+)
+
+from knops.background import spawn
 
-from SMS.tokens import add_tokens, get_token_balance
 from .keyboards import get_token_packs_keyboard
-from .products import get_pack_by_id
-from .stars_orders_store import mark_processed, was_processed
+from .products import TOKEN_PACKS, get_pack_by_id
+from .stars_orders_store import credit_and_record, was_processed
 
 logger = logging.getLogger(__name__)
 
+# premium.handlers нельзя импортировать на уровне модуля (цикл через
+# payments.__init__), поэтому кэшируем ссылку при первом обращении вместо
+# выполнения IMPORT_FROM на каждый платеж.
+_premium_handlers = None
+
+
+def _get_premium():
+    global _premium_handlers
+    if _premium_handlers is None:
+        import premium.handlers as _mod
+        _premium_handlers = _mod
+    return _premium_handlers
+
+
 PAY_HELP_CALLBACK = "pay:help"
 STARS_PAY_PREFIX = "stars:pay:"
+_TOPUP_CHOICES = frozenset({"topup:tokens", "topup:premium"})
+
+# Ожидаемые суммы по пакетам для pre-checkout: Telegram дает ~10 секунд на
+# ответ, поэтому валидация должна быть одним dict-lookup без обхода каталога.
+_PACK_PRICES = {pack.pack_id: int(pack.price_amount) for pack in TOKEN_PACKS}
+
+# Шаблон подтверждения платежа: собран один раз, в обработчике остается
+# только %-подстановка чисел.
+_SUCCESS_TPL = (
+    "✅ <b>Платёж успешно обработан!</b>\n\n"
+    "⭐ Начислено: %d токенов\n"
+    "💰 Текущий баланс: %d токенов"
+)
+
+# Меню пополнения полностью статично — собираем markup и текст один раз
+# при импорте, как в knops.keyboards. По одной кнопке в ряд.
+_TOPUP_MENU_MARKUP = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="💰 Купить токены", callback_data="topup:tokens")],
+        [InlineKeyboardButton(text="⭐ Купить премиум", callback_data="topup:premium")],
+    ]
+)
+_TOPUP_MENU_TEXT = (
+    "💰 <b>Пополнение баланса</b>\n\n"
+    "Выбери, что хочешь купить:"
+)
+_TOPUP_TOKENS_TEXT = (
+    "💰 <b>Пополнение токенов</b>\n\n"
+    "Оплата в Telegram Stars. 1 звезда = 1 сообщение.\n"
+    "Выбери пакет ниже, оплати звёздами, и токены автоматически поступят на баланс."
+)
+_PAYSUPPORT_TEXT = (
+    "💬 <b>Поддержка по платежам</b>\n\n"
+    "По вопросам возврата средств и другим вопросам, связанным с оплатой, "
+    "обратитесь к администратору бота.\n\n"
+    "Все платежи обрабатываются через Telegram Stars."
+)
+
+
+def _swallow_ack_error(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception():
+        logger.debug(f"Ошибка ответа на callback: {task.exception()}")
+
+
+def _ack_callback(call: CallbackQuery) -> None:
+    """
+    Отвечает на callback в фоне: ACK Telegram не обязан завершиться до начала
+    реальной работы обработчика, так что не платим сетевой RTT в latency.
+    Не использовать для pre_checkout_query — там ответ обязан быть синхронным.
+    """
+    # spawn держит ссылку на задачу (голый create_task мог быть собран GC
+    # до завершения), _swallow_ack_error забирает возможное исключение
+    spawn(call.answer()).add_done_callback(_swallow_ack_error)
 
 
 async def _send_topup_menu(message: Message) -> None:
     """Показывает меню пополнения баланса с выбором: токены или премиум."""
-    from aiogram.utils.keyboard import InlineKeyboardBuilder
-    
-    builder = InlineKeyboardBuilder()
-    builder.button(text="💰 Купить токены", callback_data="topup:tokens")
-    builder.button(text="⭐ Купить премиум", callback_data="topup:premium")
-    builder.adjust(1)  # По одной кнопке в ряд
-    
-    text = (
-        "💰 <b>Пополнение баланса</b>\n\n"
-        "Выбери, что хочешь купить:"
-    )
-    await message.answer(text, reply_markup=builder.as_markup(), parse_mode="HTML")
+    await message.answer(_TOPUP_MENU_TEXT, reply_markup=_TOPUP_MENU_MARKUP, parse_mode="HTML")
 
 
 async def start_topup_via_command(message: Message) -> None:
@@ -48,7 +124,7 @@ async def start_topup_via_button(message: Message) -> None:
 
 
 async def handle_topup_help(call: CallbackQuery) -> None:
-    await call.answer()
+    _ack_callback(call)
     await call.message.answer(
         "После оплаты в Telegram Stars бот автоматически начислит токены. "
         "1 звезда = 1 сообщение. Если баланс не обновился, напиши в поддержку.",
@@ -57,11 +133,8 @@ async def handle_topup_help(call: CallbackQuery) -> None:
 
 async def handle_topup_choice(call: CallbackQuery, bot: Bot) -> None:
     """Обрабатывает выбор в меню пополнения баланса."""
-    try:
-        await call.answer()
-    except Exception:
-        pass  # Игнорируем ошибки ответа на callback
-    
+    _ack_callback(call)
+
     if not call.data:
         logger.error("handle_topup_choice: call.data is None")
         if call.message:
@@ -74,23 +147,22 @@ async def handle_topup_choice(call: CallbackQuery, bot: Bot) -> None:
     
     logger.info(f"handle_topup_choice вызван с data={call.data}")
     
-    choice = call.data.split(":")[-1] if ":" in call.data else call.data
+    # rpartition вместо split: кортеж из трех строк без промежуточного списка
+    _, sep, choice = call.data.rpartition(":")
+    if not sep:
+        choice = call.data
     logger.info(f"handle_topup_choice: выбор={choice}")
     
     try:
         if choice == "tokens":
             # Показываем меню с пакетами токенов
-            text = (
-                "💰 <b>Пополнение токенов</b>\n\n"
-                "Оплата в Telegram Stars. 1 звезда = 1 сообщение.\n"
-                "Выбери пакет ниже, оплати звёздами, и токены автоматически поступят на баланс."
+            await call.message.answer(
+                _TOPUP_TOKENS_TEXT, reply_markup=get_token_packs_keyboard(), parse_mode="HTML"
             )
-            await call.message.answer(text, reply_markup=get_token_packs_keyboard(), parse_mode="HTML")
         elif choice == "premium":
             # Показываем меню премиум - call.message это уже Message объект
             logger.info("handle_topup_choice: показываем меню премиум")
-            from premium.handlers import show_premium_menu
-            await show_premium_menu(call.message)
+            await _get_premium().show_premium_menu(call.message)
         else:
             logger.warning(f"Неизвестный выбор в handle_topup_choice: {choice}, data={call.data}")
             await call.message.answer("Неверный выбор. Попробуй снова.")
@@ -102,9 +174,10 @@ async def handle_topup_choice(call: CallbackQuery, bot: Bot) -> None:
 
 async def handle_stars_payment_callback(call: CallbackQuery, bot: Bot) -> None:
     """Обрабатывает нажатие на кнопку оплаты в звёздах."""
-    await call.answer()
-    parts = (call.data or "").split(":")
-    pack_id = parts[-1] if len(parts) >= 3 else None
+    _ack_callback(call)
+    _, sep, pack_id = (call.data or "").rpartition(":")
+    if not sep:
+        pack_id = None
     pack = get_pack_by_id(pack_id)
     if not pack:
         await call.message.answer("Не удалось определить пакет. Попробуй снова.")
@@ -117,13 +190,9 @@ async def handle_stars_payment_callback(call: CallbackQuery, bot: Bot) -> None:
             "tokens": pack.tokens,
             "user_id": call.from_user.id,
         }
-        payload = json.dumps(payload_data)
+        payload = _dumps(payload_data)
 
-        # Создаём кнопку оплаты
-        builder = InlineKeyboardBuilder()
-        builder.button(text=f"Оплатить {int(pack.price_amount)} ⭐", pay=True)
-
-        # Отправляем счёт на оплату
+        # Отправляем счёт на оплату; кнопка и цены предсобраны в TokenPack
         await bot.send_invoice(
             chat_id=call.from_user.id,
             title=pack.title,
@@ -131,8 +200,8 @@ async def handle_stars_payment_callback(call: CallbackQuery, bot: Bot) -> None:
             payload=payload,
             provider_token="",  # Для Telegram Stars должен быть пустой
             currency="XTR",  # XTR - валюта Telegram Stars
-            prices=[LabeledPrice(label=pack.title, amount=int(pack.price_amount))],
-            reply_markup=builder.as_markup(),
+            prices=pack.prices,
+            reply_markup=pack.reply_markup,
         )
     except Exception as e:
         logger.error("Ошибка при создании платежа в звёздах: %s", e, exc_info=True)
@@ -145,31 +214,29 @@ async def handle_pre_checkout_query(pre_checkout_query: PreCheckoutQuery, bot: B
     """Обрабатывает предчекаут-запрос перед оплатой."""
     try:
         # Проверяем payload
-        payload_data = json.loads(pre_checkout_query.invoice_payload)
+        payload_data = _loads(pre_checkout_query.invoice_payload)
         payment_type = payload_data.get("type")
         
         # Обработка премиум подписки
         if payment_type == "premium":
-            from premium.handlers import handle_premium_pre_checkout
-            await handle_premium_pre_checkout(pre_checkout_query, bot)
+            await _get_premium().handle_premium_pre_checkout(pre_checkout_query, bot)
             return
         
-        # Обработка токенов (старая логика)
-        pack_id = payload_data.get("pack_id")
-        pack = get_pack_by_id(pack_id)
-        
-        if not pack:
+        # Обработка токенов: цена пакета предвычислена в _PACK_PRICES
+        expected_amount = _PACK_PRICES.get(payload_data.get("pack_id"))
+
+        if expected_amount is None:
             await pre_checkout_query.answer(ok=False, error_message="Пакет не найден")
             return
-        
+
         # Проверяем сумму
-        if pre_checkout_query.total_amount != int(pack.price_amount):
+        if pre_checkout_query.total_amount != expected_amount:
             await pre_checkout_query.answer(ok=False, error_message="Неверная сумма платежа")
             return
-        
+
         # Подтверждаем платеж
         await pre_checkout_query.answer(ok=True)
-    except json.JSONDecodeError:
+    except ValueError:
         await pre_checkout_query.answer(ok=False, error_message="Ошибка в данных платежа")
     except Exception as e:
         logger.error("Ошибка при обработке pre_checkout_query: %s", e, exc_info=True)
@@ -184,13 +251,12 @@ async def handle_successful_payment(message: Message, bot: Bot) -> None:
     
     try:
         # Извлекаем данные из payload
-        payload_data = json.loads(payment.invoice_payload)
+        payload_data = _loads(payment.invoice_payload)
         payment_type = payload_data.get("type")
         
         # Обработка премиум подписки
         if payment_type == "premium":
-            from premium.handlers import handle_premium_successful_payment
-            await handle_premium_successful_payment(message, bot)
+            await _get_premium().handle_premium_successful_payment(message, bot)
             return
         
         # Обработка токенов (старая логика)
@@ -205,22 +271,18 @@ async def handle_successful_payment(message: Message, bot: Bot) -> None:
             await message.answer("Этот платёж уже был обработан ранее.")
             return
         
-        # Начисляем токены
+        # Начисляем токены и фиксируем платеж одной транзакцией
         if tokens:
-            add_tokens(user_id, tokens)
-            balance = get_token_balance(user_id)
-            mark_processed(payment_id, status="paid", tokens=tokens, user_id=user_id)
-            
+            balance = credit_and_record(user_id, tokens, payment_id)
+
             await message.answer(
-                f"✅ <b>Платёж успешно обработан!</b>\n\n"
-                f"⭐ Начислено: {tokens} токенов\n"
-                f"💰 Текущий баланс: {balance} токенов",
+                _SUCCESS_TPL % (tokens, balance),
                 parse_mode="HTML",
             )
         else:
             logger.warning("Платёж без указания количества токенов: %s", payment_id)
             await message.answer("Платёж получен, но не удалось определить количество токенов.")
-    except json.JSONDecodeError:
+    except ValueError:
         logger.error("Ошибка при парсинге payload платежа")
         await message.answer("Ошибка при обработке платежа. Обратитесь в поддержку.")
     except Exception as e:
@@ -230,32 +292,23 @@ async def handle_successful_payment(message: Message, bot: Bot) -> None:
 
 async def handle_pay_support_command(message: Message) -> None:
     """Обрабатывает команду /paysupport (требуется Telegram для возвратов)."""
-    await message.answer(
-        "💬 <b>Поддержка по платежам</b>\n\n"
-        "По вопросам возврата средств и другим вопросам, связанным с оплатой, "
-        "обратитесь к администратору бота.\n\n"
-        "Все платежи обрабатываются через Telegram Stars.",
-        parse_mode="HTML",
-    )
+    await message.answer(_PAYSUPPORT_TEXT, parse_mode="HTML")
 
 
 def register_payment_handlers(dp: Dispatcher) -> None:
     dp.message.register(start_topup_via_command, Command("topup"))
-    dp.message.register(start_topup_via_button, lambda m: m.text == "💰 Пополнить баланс")
+    dp.message.register(start_topup_via_button, F.text == "💰 Пополнить баланс")
     dp.message.register(handle_pay_support_command, Command("paysupport"))
 
-    dp.callback_query.register(handle_topup_help, lambda c: c.data == PAY_HELP_CALLBACK)
+    dp.callback_query.register(handle_topup_help, F.data == PAY_HELP_CALLBACK)
     # Регистрируем обработчик выбора в меню пополнения (должен быть до других обработчиков)
-    dp.callback_query.register(
-        handle_topup_choice,
-        lambda c: c.data is not None and (c.data == "topup:tokens" or c.data == "topup:premium"),
-    )
+    dp.callback_query.register(handle_topup_choice, F.data.in_(_TOPUP_CHOICES))
     dp.callback_query.register(
         handle_stars_payment_callback,
-        lambda c: c.data and c.data.startswith(STARS_PAY_PREFIX),
+        F.data.startswith(STARS_PAY_PREFIX),
     )
 
     # Обработчики платежей
     dp.pre_checkout_query.register(handle_pre_checkout_query)
-    dp.message.register(handle_successful_payment, lambda m: m.successful_payment is not None)
+    dp.message.register(handle_successful_payment, F.successful_payment)
 
@@ -4,11 +4,17 @@ Inline-клавиатуры для выбора пакетов токенов.
 
 from __future__ import annotations
 
+from functools import lru_cache
+
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 from .products import iter_token_packs
 
 
+# Пакеты статичны на все время жизни процесса, поэтому markup собирается один
+# раз. aiogram v3 только сериализует reply_markup и не мутирует объект —
+# общий экземпляр безопасен (та же схема, что в knops.keyboards).
+@lru_cache(maxsize=1)
 def get_token_packs_keyboard() -> InlineKeyboardMarkup:
     """Создаёт клавиатуру с пакетами для оплаты в Telegram Stars."""
     rows: list[list[InlineKeyboardButton]] = []
@@ -5,8 +5,11 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from functools import cached_property
 import os
-from typing import Iterable, List, Optional
+from typing import List, Optional, Sequence
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice
 
 DEFAULT_ASSET = os.getenv("TRIBUTE_DEFAULT_ASSET", "XTR")
 
@@ -26,6 +29,25 @@ class TokenPack:
     def price_label(self) -> str:
         return f"{self.price_amount:g} {self.asset}"
 
+    # Пакеты статичны, поэтому цены и кнопку оплаты для send_invoice строим
+    # один раз на пакет, а не на каждый тап. cached_property пишет напрямую
+    # в __dict__, что работает и для frozen-датакласса.
+    @cached_property
+    def prices(self) -> list[LabeledPrice]:
+        return [LabeledPrice(label=self.title, amount=int(self.price_amount))]
+
+    @cached_property
+    def reply_markup(self) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    InlineKeyboardButton(
+                        text=f"Оплатить {int(self.price_amount)} ⭐", pay=True
+                    )
+                ]
+            ]
+        )
+
 
 TOKEN_PACKS: List[TokenPack] = [
     # Пакеты для оплаты в Telegram Stars (1 звезда = 1 токен)
@@ -74,17 +96,18 @@ TOKEN_PACKS: List[TokenPack] = [
 ]
 
 
-def iter_token_packs() -> Iterable[TokenPack]:
-    return list(TOKEN_PACKS)
+# Каталог статичен: индекс по ID и неизменяемый кортеж строятся один раз,
+# обработчики callback-ов получают O(1) lookup без аллокаций на вызов
+_PACKS_BY_ID = {pack.pack_id: pack for pack in TOKEN_PACKS}
+_PACKS_TUPLE = tuple(TOKEN_PACKS)
+
+
+def iter_token_packs() -> Sequence[TokenPack]:
+    return _PACKS_TUPLE
 
 
 def get_pack_by_id(pack_id: str | None) -> Optional[TokenPack]:
-    if not pack_id:
-        return None
-    for pack in TOKEN_PACKS:
-        if pack.pack_id == pack_id:
-            return pack
-    return None
+    return _PACKS_BY_ID.get(pack_id) if pack_id else None
 
 
 __all__ = ["TokenPack", "TOKEN_PACKS", "iter_token_packs", "get_pack_by_id"]
@@ -6,24 +6,113 @@
 from __future__ import annotations
 
 import logging
-from typing import Optional
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
 
-from SMS.database import get_db_connection, init_database
+from SMS.database import get_db_connection, get_read_connection, init_database
+from SMS.tokens import DEFAULT_START_TOKENS, invalidate_balance
 
 logger = logging.getLogger(__name__)
 
+# LRU-кэш недавно обработанных платежей перед SQLite: повторные проверки
+# (ретраи Telegram) приходят в течение секунд после оригинала, и для них
+# достаточно dict-lookup вместо похода в БД. Храним только статус 'paid' —
+# именно его проверяет was_processed.
+_RECENT_MAXSIZE = 4096
+_recent_processed: OrderedDict[str, None] = OrderedDict()
+_recent_lock = threading.Lock()
+
+# Одноразовая инициализация схемы: после первого вызова остается только
+# проверка флага вместо полного CREATE TABLE/PRAGMA round-trip на вызов
+_init_lock = threading.Lock()
+_initialized = False
+
+# SQL горячего цикла синка — константы уровня модуля: один и тот же объект
+# строки на каждый вызов, так что statement cache соединения всегда попадает
+# в уже разобранный запрос
+_SQL_WAS_PROCESSED = (
+    "SELECT status FROM stars_orders WHERE payment_id = ? AND status = 'paid'"
+)
+_SQL_MARK = """
+    INSERT INTO stars_orders (payment_id, user_id, status, tokens, updated_at)
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(payment_id) DO UPDATE SET
+        status = ?,
+        tokens = ?,
+        user_id = COALESCE(?, user_id),
+        updated_at = CURRENT_TIMESTAMP
+"""
+# Claim перезаписывает строки с ошибочным статусом (платеж, у которого API
+# временно не отдал user_id/amount, начислится на следующем цикле), но
+# никогда не трогает уже оплаченные — WHERE отсекает и повторный 'paid',
+# и понижение 'paid' до ошибки
+_SQL_CLAIM = """
+    INSERT INTO stars_orders (payment_id, user_id, status, tokens, updated_at)
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(payment_id) DO UPDATE SET
+        status = excluded.status,
+        tokens = excluded.tokens,
+        user_id = COALESCE(excluded.user_id, user_id),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE stars_orders.status != 'paid'
+"""
+_SQL_CREDIT = """
+    INSERT INTO token_balances (user_id, tokens, updated_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(user_id) DO UPDATE SET
+        tokens = MAX(0, CAST(tokens AS INTEGER) + ?),
+        updated_at = CURRENT_TIMESTAMP
+    RETURNING tokens
+"""
+_SQL_RECORD_PAID = """
+    INSERT INTO stars_orders (payment_id, user_id, status, tokens, updated_at)
+    VALUES (?, ?, 'paid', ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(payment_id) DO UPDATE SET
+        status = 'paid',
+        tokens = ?,
+        user_id = COALESCE(?, user_id),
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+
+def ensure_db() -> None:
+    """Однократно инициализирует схему users.db (далее — проверка флага)."""
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if not _initialized:
+            init_database()
+            _initialized = True
+
+
+def _remember_processed(payment_id: str) -> None:
+    with _recent_lock:
+        _recent_processed[payment_id] = None
+        _recent_processed.move_to_end(payment_id)
+        while len(_recent_processed) > _RECENT_MAXSIZE:
+            _recent_processed.popitem(last=False)
+
 
 def was_processed(payment_id: str) -> bool:
     """Проверяет, был ли платеж уже обработан."""
-    init_database()
-    
-    with get_db_connection() as conn:
+    with _recent_lock:
+        if payment_id in _recent_processed:
+            _recent_processed.move_to_end(payment_id)
+            return True
+
+    ensure_db()
+
+    # Чистое чтение — read-only пул, не конкурирующий с писателем
+    with get_read_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "SELECT status FROM stars_orders WHERE payment_id = ? AND status = 'paid'",
-            (payment_id,)
-        )
-        return cursor.fetchone() is not None
+        cursor.execute(_SQL_WAS_PROCESSED, (payment_id,))
+        found = cursor.fetchone() is not None
+
+    if found:
+        _remember_processed(payment_id)
+    return found
 
 
 def mark_processed(
@@ -33,21 +122,126 @@ def mark_processed(
     user_id: Optional[int] = None
 ) -> None:
     """Помечает платеж как обработанный."""
-    init_database()
-    
+    ensure_db()
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        cursor.execute(_SQL_MARK, (payment_id, user_id, status, tokens, status, tokens, user_id))
+        logger.info(f"Платёж {payment_id} помечен как {status}, токены: {tokens}")
+
+    if status == "paid":
+        _remember_processed(payment_id)
+
+
+# Лимит переменных в IN-списке: у SQLite по умолчанию 999, держим запас
+_IN_CHUNK = 500
+
+
+def filter_processed_conn(conn, ids: Iterable[str]) -> set[str]:
+    """Вариант filter_processed для уже открытого соединения."""
+    unique_ids = [pid for pid in dict.fromkeys(ids) if pid]
+    if not unique_ids:
+        return set()
+
+    found: set[str] = set()
+    cursor = conn.cursor()
+    for start in range(0, len(unique_ids), _IN_CHUNK):
+        chunk = unique_ids[start:start + _IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
         cursor.execute(
-            """
-            INSERT INTO stars_orders (payment_id, user_id, status, tokens, updated_at)
-            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(payment_id) DO UPDATE SET
-                status = ?,
-                tokens = ?,
-                user_id = COALESCE(?, user_id),
-                updated_at = CURRENT_TIMESTAMP
-            """,
-            (payment_id, user_id, status, tokens, status, tokens, user_id)
+            f"SELECT payment_id FROM stars_orders "
+            f"WHERE payment_id IN ({placeholders}) AND status = 'paid'",
+            chunk,
         )
-        logger.info(f"Платёж {payment_id} помечен как {status}, токены: {tokens}")
+        found.update(row["payment_id"] for row in cursor.fetchall())
+
+    for pid in found:
+        _remember_processed(pid)
+    return found
+
+
+def filter_processed(ids: Iterable[str]) -> set[str]:
+    """
+    Возвращает подмножество переданных payment_id со статусом 'paid'.
+    Один SELECT с IN-списком на страницу вместо точечного запроса на платеж.
+    """
+    ensure_db()
+
+    with get_read_connection() as conn:
+        return filter_processed_conn(conn, ids)
+
+
+def claim_payment_conn(
+    conn,
+    payment_id: str,
+    status: str = "paid",
+    tokens: Optional[int] = None,
+    user_id: Optional[int] = None,
+) -> bool:
+    """Вариант claim_payment для уже открытого соединения (без commit)."""
+    with _recent_lock:
+        if payment_id in _recent_processed:
+            return False
+
+    cursor = conn.cursor()
+    cursor.execute(_SQL_CLAIM, (payment_id, user_id, status, tokens))
+    claimed = cursor.rowcount == 1
+
+    if claimed and status == "paid":
+        _remember_processed(payment_id)
+    return claimed
+
+
+def credit_tokens_conn(conn, user_id: int, tokens: int) -> int:
+    """
+    Начисляет токены через уже открытое соединение и возвращает новый баланс.
+    Без commit и сброса кэша баланса — это забота вызывающего после commit.
+    """
+    cursor = conn.cursor()
+    # Как и add_tokens: новый пользователь стартует с начального баланса
+    cursor.execute(_SQL_CREDIT, (user_id, DEFAULT_START_TOKENS + tokens, tokens))
+    return int(cursor.fetchone()["tokens"])
+
+
+def claim_payment(
+    payment_id: str,
+    status: str = "paid",
+    tokens: Optional[int] = None,
+    user_id: Optional[int] = None,
+) -> bool:
+    """
+    Атомарно "забирает" платеж в обработку: один UPSERT вместо пары
+    was_processed + mark_processed. Возвращает True, если платеж записан или
+    перезаписан поверх ошибочного статуса (мы его обработчик), и False, если
+    он уже был оплачен. Закрывает TOCTOU-окно между проверкой и пометкой.
+    """
+    ensure_db()
+
+    with get_db_connection() as conn:
+        return claim_payment_conn(conn, payment_id, status, tokens, user_id)
+
+
+def credit_and_record(user_id: int, tokens: int, payment_id: str) -> int:
+    """
+    Начисляет токены и помечает платеж обработанным в одной транзакции.
+
+    Заменяет цепочку add_tokens + get_token_balance + mark_processed:
+    одно соединение, один commit (один fsync) вместо трех, новый баланс
+    возвращается через RETURNING.
+    """
+    ensure_db()
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        # Как и add_tokens: новый пользователь стартует с начального баланса
+        cursor.execute(_SQL_CREDIT, (user_id, DEFAULT_START_TOKENS + tokens, tokens))
+        new_balance = int(cursor.fetchone()["tokens"])
+        cursor.execute(_SQL_RECORD_PAID, (payment_id, user_id, tokens, tokens, user_id))
+        logger.info(
+            f"Платёж {payment_id} обработан, начислено {tokens}, баланс: {new_balance}"
+        )
+
+    invalidate_balance(user_id)
+    _remember_processed(payment_id)
+    return new_balance
 
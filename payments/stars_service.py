@@ -4,18 +4,64 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
 from typing import Dict, Tuple
 
 from aiogram import Bot
 
-from SMS.tokens import add_tokens, get_token_balance
+from SMS.database import get_db_connection
+from SMS.tokens import invalidate_balance
 
 from .stars_api import list_paid_payments
-from .stars_orders_store import mark_processed, was_processed
+from .stars_orders_store import (
+    claim_payment_conn,
+    credit_tokens_conn,
+    ensure_db,
+    filter_processed_conn,
+)
 
 logger = logging.getLogger(__name__)
 
+# Параллельные отправки уведомлений: ограничиваем, чтобы не упереться
+# во flood-лимиты Telegram (как в tribute_service)
+_SEND_CONCURRENCY = 20
+
+# Варианты ключей в ответах внешнего Stars API (кортежи собраны один раз,
+# один helper вместо цепочек .get() or .get() на каждый платеж)
+_PID_KEYS = ("payment_id", "id")
+_UID_KEYS = ("user_id", "telegram_id", "tg_id")
+_AMT_KEYS = ("amount_stars", "amount", "stars")
+
+
+def _pick(data: Dict, keys: tuple) -> object:
+    for key in keys:
+        value = data.get(key)
+        if value:
+            return value
+    return None
+
+
+def _commit_restart(conn) -> None:
+    """
+    Коммитит текущую пачку и сразу открывает новую IMMEDIATE-транзакцию.
+
+    Соединение работает с isolation_level=None, и первый commit внутри блока
+    завершил бы транзакцию, открытую get_db_connection, — дальше каждый
+    statement автокоммитился бы сам по себе, и claim с кредитом перестали бы
+    быть атомарными. Явный BEGIN восстанавливает инвариант.
+    """
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+
+
+async def _notify(bot: Bot, semaphore: asyncio.Semaphore, tg_id: int, text: str) -> None:
+    async with semaphore:
+        try:
+            await bot.send_message(tg_id, text)
+        except Exception as exc:
+            logger.warning("Не удалось отправить сообщение пользователю %s: %s", tg_id, exc)
+
 
 async def sync_paid_stars_payments(bot: Bot) -> Tuple[int, int]:
     """
@@ -31,60 +77,94 @@ async def sync_paid_stars_payments(bot: Bot) -> Tuple[int, int]:
     processed = 0
     skipped = 0
 
-    for payment in payments:
-        payment_id = str(payment.get("payment_id") or payment.get("id") or "")
-        if not payment_id:
-            skipped += 1
-            continue
-
-        if was_processed(payment_id):
-            continue
-
-        # Извлекаем Telegram ID пользователя
-        user_id = payment.get("user_id") or payment.get("telegram_id") or payment.get("tg_id")
-        if not user_id:
-            logger.warning("Stars payment %s без user_id", payment_id)
-            mark_processed(payment_id, status="no_user_id", user_id=None)
-            skipped += 1
-            continue
-
-        try:
-            user_id_int = int(user_id)
-        except (TypeError, ValueError):
-            logger.warning("Stars payment %s имеет некорректный user_id: %s", payment_id, user_id)
-            mark_processed(payment_id, status="bad_user_id", user_id=None)
-            skipped += 1
-            continue
-
-        # Количество звёзд = количество токенов (1 звезда = 1 токен)
-        amount_stars = payment.get("amount_stars") or payment.get("amount") or payment.get("stars")
-        if not amount_stars:
-            logger.warning("Stars payment %s без amount_stars", payment_id)
-            mark_processed(payment_id, status="no_amount", user_id=user_id_int)
-            skipped += 1
-            continue
-
-        try:
-            tokens = int(amount_stars)
-        except (TypeError, ValueError):
-            logger.warning("Stars payment %s имеет некорректный amount_stars: %s", payment_id, amount_stars)
-            mark_processed(payment_id, status="bad_amount", user_id=user_id_int)
-            skipped += 1
-            continue
-
-        # Начисляем токены
-        add_tokens(user_id_int, tokens)
-        balance = get_token_balance(user_id_int)
-        mark_processed(payment_id, status="paid", tokens=tokens, user_id=user_id_int)
-        processed += 1
-
-        try:
-            await bot.send_message(
-                user_id_int,
-                f"⭐️ Оплата в звёздах: +{tokens} токенов\nТекущий баланс: {balance}",
+    # Уведомления копим и отправляем после цикла по БД: серийный send внутри
+    # цикла стоил round-trip к Telegram на платеж, фан-аут с ограничением
+    # параллелизма — примерно один round-trip на пачку
+    notifications: list[tuple[int, str]] = []
+
+    # Одно соединение на весь цикл синхронизации: страница из 100 платежей
+    # раньше означала сотни обращений к пулу и повторных init_database.
+    # После каждого платежа делаем commit, чтобы не держать write-lock WAL
+    # на всю страницу.
+    ensure_db()
+
+    with get_db_connection() as conn:
+        # Один SELECT на страницу: множество уже оплаченных ID, чтобы не
+        # дергать БД (даже на DO NOTHING вставку) для каждого старого платежа
+        page_ids = [str(_pick(payment, _PID_KEYS) or "") for payment in payments]
+        processed_ids = filter_processed_conn(conn, page_ids)
+
+        for payment, payment_id in zip(payments, page_ids):
+            if not payment_id:
+                skipped += 1
+                continue
+
+            if payment_id in processed_ids:
+                continue
+
+            # Валидируем платеж целиком, а потом одним UPSERT'ом "забираем"
+            # его в обработку: без пары SELECT + INSERT на платеж и без
+            # гонки, где два воркера начислили бы токены дважды.
+
+            # Извлекаем Telegram ID пользователя
+            user_id = _pick(payment, _UID_KEYS)
+            if not user_id:
+                logger.warning("Stars payment %s без user_id", payment_id)
+                claim_payment_conn(conn, payment_id, status="no_user_id", user_id=None)
+                _commit_restart(conn)
+                skipped += 1
+                continue
+
+            try:
+                user_id_int = int(user_id)
+            except (TypeError, ValueError):
+                logger.warning("Stars payment %s имеет некорректный user_id: %s", payment_id, user_id)
+                claim_payment_conn(conn, payment_id, status="bad_user_id", user_id=None)
+                _commit_restart(conn)
+                skipped += 1
+                continue
+
+            # Количество звёзд = количество токенов (1 звезда = 1 токен)
+            amount_stars = _pick(payment, _AMT_KEYS)
+            if not amount_stars:
+                logger.warning("Stars payment %s без amount_stars", payment_id)
+                claim_payment_conn(conn, payment_id, status="no_amount", user_id=user_id_int)
+                _commit_restart(conn)
+                skipped += 1
+                continue
+
+            try:
+                tokens = int(amount_stars)
+            except (TypeError, ValueError):
+                logger.warning("Stars payment %s имеет некорректный amount_stars: %s", payment_id, amount_stars)
+                claim_payment_conn(conn, payment_id, status="bad_amount", user_id=user_id_int)
+                _commit_restart(conn)
+                skipped += 1
+                continue
+
+            claimed = claim_payment_conn(
+                conn, payment_id, status="paid", tokens=tokens, user_id=user_id_int
+            )
+            if not claimed:
+                _commit_restart(conn)
+                continue
+
+            # Начисляем токены тем же соединением: claim и кредит уходят
+            # одной транзакцией, без отдельного checkout из пула на платеж
+            balance = credit_tokens_conn(conn, user_id_int, tokens)
+            _commit_restart(conn)
+            invalidate_balance(user_id_int)
+            processed += 1
+
+            notifications.append(
+                (user_id_int, f"⭐️ Оплата в звёздах: +{tokens} токенов\nТекущий баланс: {balance}")
             )
-        except Exception as e:
-            logger.warning("Не удалось отправить сообщение пользователю %s: %s", user_id_int, e)
 
-    return processed, skipped
+    if notifications:
+        semaphore = asyncio.Semaphore(_SEND_CONCURRENCY)
+        await asyncio.gather(
+            *(_notify(bot, semaphore, tg_id, text) for tg_id, text in notifications),
+            return_exceptions=True,
+        )
 
+    return processed, skipped
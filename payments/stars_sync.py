@@ -9,6 +9,7 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 import logging
 import os
 
@@ -21,16 +22,28 @@ logger = logging.getLogger(__name__)
 USE_EXTERNAL_API = os.getenv("STARS_USE_EXTERNAL_API", "false").lower() == "true"
 
 
+@functools.lru_cache(maxsize=1)
 def get_sync_interval() -> int:
-    """Возвращает интервал синхронизации в секундах."""
+    """Возвращает интервал синхронизации в секундах (читается один раз,
+    новое значение требует рестарта процесса)."""
     return int(os.getenv("STARS_SYNC_INTERVAL", "60"))
 
 
 async def _run(bot: Bot, interval: int) -> None:
-    """Основной цикл синхронизации."""
+    """
+    Основной цикл синхронизации.
+
+    Расписание считается по монотонным часам цикла: дедлайн следующего тика
+    сдвигается на interval независимо от того, сколько работал (или падал)
+    сам синк, поэтому тики не дрейфуют, а ошибка не приводит к мгновенному
+    повтору запроса к API. Первый синк выполняется сразу после старта.
+    """
+    loop = asyncio.get_running_loop()
+    next_deadline = loop.time()
     while True:
+        await asyncio.sleep(max(0.0, next_deadline - loop.time()))
+        next_deadline += interval
         try:
-            await asyncio.sleep(interval)
             processed, skipped = await sync_paid_stars_payments(bot)
             if processed > 0 or skipped > 0:
                 logger.info(
@@ -41,7 +54,7 @@ async def _run(bot: Bot, interval: int) -> None:
         except asyncio.CancelledError:
             logger.info("Stars sync task отменён")
             raise
-        except Exception as e:
+        except Exception:
             logger.error("Stars sync error", exc_info=True)
 
 
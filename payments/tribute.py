@@ -4,15 +4,18 @@
 
 from __future__ import annotations
 
+import functools
 import os
 
 DEFAULT_TRIBUTE_URL = "https://t.me/tribute/app?startapp=pna9"
 
 
+@functools.lru_cache(maxsize=1)
 def get_tribute_url() -> str:
     """
     Возвращает ссылку на мини-приложение Tribute.
-    Можно переопределить через переменную окружения TRIBUTE_STARTAPP_URL.
+    Можно переопределить через переменную окружения TRIBUTE_STARTAPP_URL
+    (читается один раз, смена значения требует рестарта).
     """
     return os.getenv("TRIBUTE_STARTAPP_URL", DEFAULT_TRIBUTE_URL)
 
@@ -4,6 +4,8 @@
 
 from __future__ import annotations
 
+import asyncio
+import functools
 import logging
 import os
 from typing import Any, Dict, List, Optional
@@ -19,6 +21,9 @@ class TributeAPIError(RuntimeError):
     pass
 
 
+# Конфигурация читается из окружения один раз на процесс: значения меняются
+# только с рестартом, а _build_headers дергается на каждый HTTP-запрос
+@functools.lru_cache(maxsize=1)
 def _get_api_key() -> str:
     key = os.getenv("TRIBUTE_API_KEY")
     if not key:
@@ -28,33 +33,105 @@ def _get_api_key() -> str:
     return key
 
 
+@functools.lru_cache(maxsize=1)
 def _get_base_url() -> str:
     return os.getenv("TRIBUTE_API_BASE_URL", DEFAULT_BASE_URL).rstrip("/")
 
 
+@functools.lru_cache(maxsize=1)
 def _build_headers() -> Dict[str, str]:
+    # Один и тот же dict на все запросы: httpx его не мутирует
     return {
         "Api-Key": _get_api_key(),
         "Accept": "application/json",
     }
 
 
+# Долгоживущий HTTP-клиент: клиент-на-запрос платил DNS + TCP + TLS handshake
+# за каждый вызов, а пул keep-alive соединений сводит это к одному рукопожатию
+# на процесс.
+_client: Optional[httpx.AsyncClient] = None
+_client_lock = asyncio.Lock()
+
+
+async def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        async with _client_lock:
+            if _client is None:
+                _client = httpx.AsyncClient(
+                    timeout=httpx.Timeout(15.0),
+                    limits=httpx.Limits(
+                        max_keepalive_connections=10, max_connections=20
+                    ),
+                )
+    return _client
+
+
+async def aclose_client() -> None:
+    """Закрывает общий HTTP-клиент (вызывается при остановке бота)."""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
+
+# Дедупликация одинаковых GET-запросов "в полете": при перекрывающихся циклах
+# синхронизации второй вызов ждет Future первого вместо собственного HTTP
+# round-trip. Кэшируется awaitable, а не результат — после завершения запись
+# удаляется и данные не устаревают.
+_inflight: dict[tuple, asyncio.Future] = {}
+
+
 async def _request(
     method: str,
     path: str,
     *,
     params: Dict[str, Any] | None = None,
     json_payload: Dict[str, Any] | None = None,
+) -> Any:
+    if method != "GET":
+        return await _do_request(method, path, params=params, json_payload=json_payload)
+
+    key = (path, tuple(sorted(params.items())) if params else None)
+    existing = _inflight.get(key)
+    if existing is not None:
+        return await existing
+
+    future: asyncio.Future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await _do_request(method, path, params=params, json_payload=json_payload)
+    except BaseException as e:
+        if not future.cancelled():
+            future.set_exception(e)
+            # Помечаем исключение полученным на случай, когда попутчиков нет
+            future.exception()
+        raise
+    else:
+        if not future.cancelled():
+            future.set_result(result)
+        return result
+    finally:
+        _inflight.pop(key, None)
+
+
+async def _do_request(
+    method: str,
+    path: str,
+    *,
+    params: Dict[str, Any] | None = None,
+    json_payload: Dict[str, Any] | None = None,
 ) -> Any:
     url = f"{_get_base_url()}{path}"
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        response = await client.request(
-            method,
-            url,
-            headers=_build_headers(),
-            params=params,
-            json=json_payload,
-        )
+    client = await _get_client()
+    response = await client.request(
+        method,
+        url,
+        headers=_build_headers(),
+        params=params,
+        json=json_payload,
+    )
     if response.status_code >= 400:
         logger.error("Tribute API error %s %s: %s", method, url, response.text[:300])
         raise TributeAPIError(f"Tribute API error: {response.status_code}")
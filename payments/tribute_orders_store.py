@@ -1,40 +1,117 @@
 """
-Простое JSON-хранилище обработанных заказов Tribute.
+Хранилище обработанных заказов Tribute.
+Использует SQLite-пул users.db; ранее было JSON-файлом, который целиком
+перечитывался и перезаписывался на каждый заказ.
 """
 
 from __future__ import annotations
 
 import json
+import logging
+import threading
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict
 
-STORE_PATH = Path(__file__).with_name("tribute_orders.json")
+from SMS.database import get_db_connection, get_read_connection, init_database
 
+logger = logging.getLogger(__name__)
 
-def _load() -> Dict[str, Dict[str, str]]:
-    if not STORE_PATH.exists():
-        return {}
+# Старый JSON-стор: мигрируется в SQLite один раз, затем переименовывается
+_LEGACY_STORE_PATH = Path(__file__).with_name("tribute_orders.json")
+
+_migrate_lock = threading.Lock()
+_migrated = False
+
+
+def _ensure_store() -> None:
+    """Инициализирует БД и один раз переносит данные из legacy-JSON."""
+    global _migrated
+    if _migrated:
+        return
+    with _migrate_lock:
+        if _migrated:
+            return
+        init_database()
+        _migrate_legacy_json()
+        _migrated = True
+
+
+def _migrate_legacy_json() -> None:
+    if not _LEGACY_STORE_PATH.exists():
+        return
     try:
-        with STORE_PATH.open("r", encoding="utf-8") as fp:
-            return json.load(fp)
+        with _LEGACY_STORE_PATH.open("r", encoding="utf-8") as fp:
+            data = json.load(fp)
     except Exception:
-        return {}
+        logger.warning("Не удалось прочитать legacy tribute_orders.json, пропускаю миграцию")
+        return
 
+    if isinstance(data, dict) and data:
+        with get_db_connection() as conn:
+            conn.executemany(
+                """
+                INSERT INTO tribute_orders (order_id, status, tokens)
+                VALUES (?, ?, ?)
+                ON CONFLICT(order_id) DO NOTHING
+                """,
+                [
+                    (str(order_id), payload.get("status", "paid"), payload.get("tokens", 0))
+                    for order_id, payload in data.items()
+                    if isinstance(payload, dict)
+                ],
+            )
+        logger.info("Мигрировано %d заказов Tribute из JSON в SQLite", len(data))
 
-def _save(data: Dict[str, Dict[str, str]]) -> None:
-    STORE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with STORE_PATH.open("w", encoding="utf-8") as fp:
-        json.dump(data, fp, ensure_ascii=False, indent=2)
+    try:
+        _LEGACY_STORE_PATH.rename(_LEGACY_STORE_PATH.with_suffix(".json.bak"))
+    except OSError as e:
+        logger.warning("Не удалось переименовать tribute_orders.json: %s", e)
 
 
 def was_processed(order_id: str) -> bool:
-    data = _load()
-    return str(order_id) in data
+    # Чистое чтение — read-only пул, не конкурирующий с писателем
+    _ensure_store()
+    with get_read_connection() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM tribute_orders WHERE order_id = ? LIMIT 1",
+            (str(order_id),),
+        ).fetchone()
+        return row is not None
 
 
 def mark_processed(order_id: str, *, status: str = "paid", tokens: int = 0) -> None:
-    data = _load()
-    data[str(order_id)] = {"status": status, "tokens": tokens}
-    _save(data)
+    _ensure_store()
+    with get_db_connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO tribute_orders (order_id, status, tokens, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(order_id) DO UPDATE SET
+                status = excluded.status,
+                tokens = excluded.tokens,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (str(order_id), status, tokens),
+        )
 
 
+def mark_processed_many(entries: Dict[str, Dict[str, object]]) -> None:
+    """Помечает пачку заказов одним executemany вместо записи на заказ."""
+    if not entries:
+        return
+    _ensure_store()
+    with get_db_connection() as conn:
+        conn.executemany(
+            """
+            INSERT INTO tribute_orders (order_id, status, tokens, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(order_id) DO UPDATE SET
+                status = excluded.status,
+                tokens = excluded.tokens,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            [
+                (str(order_id), payload.get("status", "paid"), payload.get("tokens", 0))
+                for order_id, payload in entries.items()
+            ],
+        )
@@ -4,55 +4,79 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
-from typing import Dict, Tuple
+from typing import Any, Dict, Optional, Tuple
 
 from aiogram import Bot
 
-from SMS.tokens import add_tokens, get_token_balance
+from SMS.tokens import add_tokens_bulk
 
 from .products import iter_token_packs
 from .tribute_api import list_product_orders
-from .tribute_orders_store import mark_processed, was_processed
+from .tribute_orders_store import mark_processed_many, was_processed
 
 logger = logging.getLogger(__name__)
 
+# Параллельные отправки уведомлений: ограничиваем, чтобы не упереться
+# во flood-лимиты Telegram
+_SEND_CONCURRENCY = 20
 
-def _extract_tg_id(order: Dict[str, any]) -> Optional[int]:
-    candidate_fields = [
-        "telegram_id",
-        "telegramID",
-        "telegramId",
-        "tg_id",
-        "tgId",
-    ]
-    for field in candidate_fields:
-        if field in order and order[field]:
-            try:
-                return int(order[field])
-            except (TypeError, ValueError):
-                continue
-    buyer = order.get("buyer") or order.get("user") or {}
-    for field in candidate_fields:
-        if field in buyer and buyer[field]:
+
+# Варианты ключей с Telegram ID в ответах Tribute (кортеж собран один раз,
+# dict.get вместо пары `in` + `[]` на каждую пробу)
+_TG_ID_FIELDS: Tuple[str, ...] = ("telegram_id", "telegramID", "telegramId", "tg_id", "tgId")
+
+
+def _first_int(data: Dict[str, Any], keys: Tuple[str, ...]) -> Optional[int]:
+    for key in keys:
+        value = data.get(key)
+        if value:
             try:
-                return int(buyer[field])
+                return int(value)
             except (TypeError, ValueError):
                 continue
     return None
 
 
+def _extract_tg_id(order: Dict[str, Any]) -> Optional[int]:
+    return _first_int(order, _TG_ID_FIELDS) or _first_int(
+        order.get("buyer") or order.get("user") or {}, _TG_ID_FIELDS
+    )
+
+
+async def _notify(bot: Bot, semaphore: asyncio.Semaphore, tg_id: int, text: str) -> None:
+    async with semaphore:
+        try:
+            await bot.send_message(tg_id, text)
+        except Exception as exc:
+            logger.warning("Не удалось отправить сообщение пользователю %s: %s", tg_id, exc)
+
+
 async def sync_paid_orders(bot: Bot) -> Tuple[int, int]:
     processed = 0
     skipped = 0
-    for pack in iter_token_packs():
-        if not pack.product_id:
-            continue
-        try:
-            orders = await list_product_orders(pack.product_id, status="paid")
-        except Exception:
-            logger.exception("Не удалось загрузить заказы для товара %s", pack.product_id)
+
+    # Сначала собираем все новые заказы, потом начисляем одной транзакцией
+    # и помечаем одной записью стора — вместо трех операций на заказ
+    to_credit: list[tuple[int, int, str]] = []  # (tg_id, tokens, storage_id)
+    marks: Dict[str, Dict[str, object]] = {}
+
+    # Заказы всех продуктов загружаем параллельно: запросы независимы, а общий
+    # HTTP-клиент переиспользует соединения, так что фаза фетча стоит max(RTT)
+    # вместо суммы RTT по продуктам
+    packs = [pack for pack in iter_token_packs() if pack.product_id]
+    results = await asyncio.gather(
+        *(list_product_orders(pack.product_id, status="paid") for pack in packs),
+        return_exceptions=True,
+    )
+
+    for pack, orders in zip(packs, results):
+        if isinstance(orders, BaseException):
+            logger.error(
+                "Не удалось загрузить заказы для товара %s: %s", pack.product_id, orders
+            )
             continue
 
         for order in orders:
@@ -61,29 +85,36 @@ async def sync_paid_orders(bot: Bot) -> Tuple[int, int]:
                 skipped += 1
                 continue
             storage_id = f"{pack.product_id}:{order_id}"
-            if was_processed(storage_id):
+            if storage_id in marks or was_processed(storage_id):
                 continue
 
             tg_id = _extract_tg_id(order)
             if not tg_id:
                 logger.warning("Заказ %s (product %s) без Telegram ID", order_id, pack.product_id)
-                mark_processed(storage_id, status="no_tg_id")
+                marks[storage_id] = {"status": "no_tg_id", "tokens": 0}
                 skipped += 1
                 continue
 
-            add_tokens(tg_id, pack.tokens)
-            balance = get_token_balance(tg_id)
-            mark_processed(storage_id, status="paid", tokens=pack.tokens)
+            to_credit.append((tg_id, pack.tokens, storage_id))
+            marks[storage_id] = {"status": "paid", "tokens": pack.tokens}
             processed += 1
 
-            try:
-                await bot.send_message(
+    balances = add_tokens_bulk([(tg_id, tokens) for tg_id, tokens, _ in to_credit])
+    mark_processed_many(marks)
+
+    if to_credit:
+        semaphore = asyncio.Semaphore(_SEND_CONCURRENCY)
+        await asyncio.gather(
+            *(
+                _notify(
+                    bot,
+                    semaphore,
                     tg_id,
-                    f"⭐️ Tribute: +{pack.tokens} токенов\nТекущий баланс: {balance}",
+                    f"⭐️ Tribute: +{tokens} токенов\nТекущий баланс: {balances.get(tg_id, '?')}",
                 )
-            except Exception as exc:
-                logger.warning("Не удалось отправить сообщение пользователю %s: %s", tg_id, exc)
+                for tg_id, tokens, _ in to_credit
+            ),
+            return_exceptions=True,
+        )
 
     return processed, skipped
-
-
@@ -5,6 +5,7 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 import logging
 import os
 from typing import Optional
@@ -16,7 +17,9 @@ from .tribute_service import sync_paid_orders
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=1)
 def get_sync_interval() -> int:
+    # Читается один раз на процесс; новое значение требует рестарта
     try:
         return max(30, int(os.getenv("TRIBUTE_SYNC_INTERVAL", "60")))
     except ValueError:
@@ -30,13 +33,18 @@ def start_tribute_sync(bot: Bot) -> asyncio.Task:
 
 
 async def _run(bot: Bot, interval: int) -> None:
+    # Дедлайны по монотонным часам цикла: частота тиков не зависит от
+    # длительности самого синка (см. stars_sync._run)
+    loop = asyncio.get_running_loop()
+    next_deadline = loop.time()
     while True:
+        await asyncio.sleep(max(0.0, next_deadline - loop.time()))
+        next_deadline += interval
         try:
             processed, skipped = await sync_paid_orders(bot)
             if processed:
                 logger.info("Tribute sync: начислено %s заказов (пропущено %s)", processed, skipped)
         except Exception:
             logger.exception("Tribute sync error")
-        await asyncio.sleep(interval)
 
 
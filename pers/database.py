@@ -6,6 +6,7 @@ SQLite база данных для хранения персонажей (Perso
 
 from __future__ import annotations
 
+import atexit
 import sqlite3
 import os
 import logging
@@ -15,28 +16,44 @@ from typing import Optional, List, Dict, Any
 from contextlib import contextmanager
 from pathlib import Path
 
+from pers.db_sync import mark_db_dirty
+
 logger = logging.getLogger(__name__)
 
 # Путь к БД: создается в той же папке, где лежит этот файл
 BASE_DIR = Path(__file__).parent
 DB_PATH = BASE_DIR / "personas.db"
 
-# Настройки connection pool (как в users.db)
-POOL_SIZE = 5
+# Настройки connection pool (как в users.db).
+# WAL допускает одного писателя и много читателей, поэтому пул разделен:
+# одно пишущее соединение и пул read-only читателей, которые не
+# конкурируют с ним за блокировку.
+POOL_SIZE = 1  # Количество пишущих соединений в пуле
+READ_POOL_SIZE = max(2, os.cpu_count() or 2)  # Количество читающих соединений
 POOL_TIMEOUT = 10.0
 
-# Thread-safe пул соединений
+# Thread-safe пулы соединений
 _connection_pool: Optional[queue.Queue] = None
 _pool_lock = threading.Lock()
 _pool_initialized = False
 
+_read_pool: Optional[queue.Queue] = None
+_read_pool_lock = threading.Lock()
+_read_pool_initialized = False
+
+# Поколение пула: close_all_connections инкрементирует счетчик, и соединение,
+# взятое до закрытия, по возврату закрывается вместо возврата в новый пул
+_pool_generation = 0
+
 
 def _create_connection() -> sqlite3.Connection:
     """Создает новое соединение с БД с оптимальными настройками."""
     # Создаем папку, если её нет
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
     
-    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False, timeout=10.0)
+    conn = sqlite3.connect(
+        str(DB_PATH), check_same_thread=False, timeout=10.0, cached_statements=256
+    )
     conn.row_factory = sqlite3.Row
     
     # Оптимизации для производительности (WAL режим)
@@ -49,8 +66,57 @@ def _create_connection() -> sqlite3.Connection:
     return conn
 
 
+def _create_read_connection() -> sqlite3.Connection:
+    """Создает read-only соединение (URI mode=ro + query_only)."""
+    conn = sqlite3.connect(
+        f"file:{DB_PATH}?mode=ro",
+        uri=True,
+        check_same_thread=False,
+        timeout=10.0,
+        cached_statements=256,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+
+def _init_read_pool() -> None:
+    """Инициализирует пул читающих соединений."""
+    global _read_pool, _read_pool_initialized
+
+    if _read_pool_initialized:
+        return
+
+    with _read_pool_lock:
+        if _read_pool_initialized:
+            return
+
+        # mode=ro требует существующего файла БД — создаем схему через
+        # пишущее соединение (no-op после первого вызова)
+        init_database()
+
+        _read_pool = queue.Queue(maxsize=READ_POOL_SIZE)
+        for _ in range(READ_POOL_SIZE):
+            try:
+                _read_pool.put(_create_read_connection())
+            except Exception as e:
+                logger.error(f"Ошибка при создании читающего соединения personas: {e}")
+
+        _read_pool_initialized = True
+        logger.info(f"Инициализирован read-only pool personas.db размером {READ_POOL_SIZE}")
+
+
 def _init_pool() -> None:
-    """Инициализирует пул соединений."""
+    """
+    Инициализирует пул соединений и (однократно) схему БД.
+
+    Схема создается на первом соединении до его попадания в очередь, поэтому
+    CRUD-функциям не нужны прологи `if not _pool_initialized: init_database()`
+    — любой checkout из пула гарантирует готовую схему.
+    """
     global _connection_pool, _pool_initialized
     
     if _pool_initialized:
@@ -59,13 +125,19 @@ def _init_pool() -> None:
     with _pool_lock:
         if _pool_initialized:
             return
-        
+
+        # Сначала пробуем забрать БД из облака: sqlite3.connect ниже создал
+        # бы пустой файл, и проверка "локальной нет" перестала бы срабатывать
+        _load_database_from_cloud()
+
         _connection_pool = queue.Queue(maxsize=POOL_SIZE)
         
         # Создаем начальные соединения
-        for _ in range(POOL_SIZE):
+        for index in range(POOL_SIZE):
             try:
                 conn = _create_connection()
+                if index == 0:
+                    _run_schema(conn)
                 _connection_pool.put(conn)
             except Exception as e:
                 logger.error(f"Ошибка при создании соединения для пула personas: {e}")
@@ -74,34 +146,45 @@ def _init_pool() -> None:
         logger.info(f"Инициализирован connection pool для personas.db размером {POOL_SIZE}")
 
 
+def _drain_pool(pool: Optional[queue.Queue]) -> int:
+    """Закрывает все соединения из уже отцепленной очереди."""
+    if pool is None:
+        return 0
+    closed = 0
+    while True:
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            conn.close()
+            closed += 1
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии соединения personas: {e}")
+    return closed
+
+
 def close_all_connections() -> None:
-    """Закрывает все соединения из пула (для корректного бекапа)."""
-    global _connection_pool, _pool_initialized
-    
-    if not _pool_initialized or not _connection_pool:
-        return
-    
+    """Закрывает все соединения из пулов (для корректного бекапа)."""
+    global _connection_pool, _pool_initialized, _pool_generation
+    global _read_pool, _read_pool_initialized
+
+    # Под локами только отцепляем пулы и двигаем поколение; close выполняются
+    # ниже без локов, не задерживая параллельные checkout'ы
     with _pool_lock:
-        if not _connection_pool:
-            return
-        
-        closed_count = 0
-        while True:
-            try:
-                conn = _connection_pool.get_nowait()
-                try:
-                    conn.close()
-                    closed_count += 1
-                except Exception as e:
-                    logger.warning(f"Ошибка при закрытии соединения personas: {e}")
-            except queue.Empty:
-                break
-        
+        pool = _connection_pool
         _connection_pool = None
         _pool_initialized = False
-        
-        if closed_count > 0:
-            logger.info(f"Закрыто {closed_count} соединений personas.db")
+        _pool_generation += 1
+
+    with _read_pool_lock:
+        read_pool = _read_pool
+        _read_pool = None
+        _read_pool_initialized = False
+
+    closed_count = _drain_pool(pool) + _drain_pool(read_pool)
+    if closed_count > 0:
+        logger.info(f"Закрыто {closed_count} соединений personas.db")
 
 
 @contextmanager
@@ -112,6 +195,7 @@ def get_db_connection(timeout: float = 10.0):
     """
     _init_pool()
     
+    generation = _pool_generation
     conn = None
     try:
         try:
@@ -120,22 +204,16 @@ def get_db_connection(timeout: float = 10.0):
             logger.warning("Пул personas пуст, создается временное соединение")
             conn = _create_connection()
         
-        # Проверка здоровья соединения
-        try:
-            conn.execute("SELECT 1").fetchone()
-        except sqlite3.Error:
-            logger.warning("Соединение personas мертво, пересоздание")
-            try:
-                conn.close()
-            except:
-                pass
-            conn = _create_connection()
-        
+        changes_before = conn.total_changes
         yield conn
-        
+
         # ВАЖНО: Явный commit для сохранения изменений
         try:
             conn.commit()
+            # Рост total_changes означает фактическую запись — помечаем БД
+            # для следующей синхронизации в облако
+            if conn.total_changes != changes_before:
+                mark_db_dirty("personas.db")
         except Exception as commit_error:
             logger.error(f"Ошибка при commit в personas.db: {commit_error}")
             if conn:
@@ -151,20 +229,91 @@ def get_db_connection(timeout: float = 10.0):
                 conn.rollback()
             except Exception:
                 pass
+            # Health-check на каждый checkout убран (см. SMS.database);
+            # мертвое соединение заменяем свежим прямо в пуле
+            if isinstance(e, (sqlite3.OperationalError, sqlite3.ProgrammingError)):
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                conn = None
+                try:
+                    _connection_pool.put_nowait(_create_connection())
+                except Exception as repl_error:
+                    logger.warning(f"Не удалось заменить соединение personas: {repl_error}")
         logger.error(f"Ошибка БД personas: {e}")
         raise
     finally:
         if conn:
-            try:
-                _connection_pool.put_nowait(conn)
-            except queue.Full:
-                conn.close()
-            except Exception as e:
-                logger.warning(f"Ошибка возврата в пул: {e}")
+            pool = _connection_pool
+            if generation != _pool_generation or pool is None:
+                # Пул заменен (close_all_connections) пока соединение было
+                # в работе — закрываем, а не возвращаем в новый пул
                 try:
                     conn.close()
-                except:
+                except Exception:
                     pass
+            else:
+                try:
+                    pool.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+                except Exception as e:
+                    logger.warning(f"Ошибка возврата в пул: {e}")
+                    try:
+                        conn.close()
+                    except:
+                        pass
+
+
+# Пишущий пул — это и есть get_db_connection; алиас для явных вызовов
+get_write_connection = get_db_connection
+
+
+@contextmanager
+def get_read_connection():
+    """
+    Контекстный менеджер для чистых чтений: read-only соединение из
+    отдельного пула. Читатели в WAL не конкурируют с писателем, нет
+    commit/rollback и dirty-трекинга.
+    """
+    _init_read_pool()
+
+    generation = _pool_generation
+    conn = None
+    try:
+        try:
+            conn = _read_pool.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            logger.warning("Read-пул personas пуст, создается временное соединение")
+            conn = _create_read_connection()
+
+        yield conn
+    except Exception as e:
+        logger.error(f"Ошибка БД personas (чтение): {e}")
+        raise
+    finally:
+        if conn:
+            pool = _read_pool
+            if generation != _pool_generation or pool is None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            else:
+                try:
+                    pool.put_nowait(conn)
+                except queue.Full:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                except Exception as e:
+                    logger.warning(f"Ошибка при возврате читающего соединения personas: {e}")
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
 
 
 def _load_database_from_cloud() -> None:
@@ -201,50 +350,62 @@ def _load_database_from_cloud() -> None:
 
 
 def init_database() -> None:
-    """Инициализирует структуру таблиц."""
-    _load_database_from_cloud()
+    """Инициализирует пул и структуру таблиц (повторные вызовы — no-op)."""
+    _init_pool()
+
+
+def _run_schema(conn: sqlite3.Connection) -> None:
+    """Создает/мигрирует схему на переданном соединении (вне пула)."""
+    cursor = conn.cursor()
+
+    # Основная таблица
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS personas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            owner_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            age INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            character TEXT,
+            scene TEXT,
+            photo_path TEXT NOT NULL,
+            photo_url TEXT,
+            public BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(owner_id, name)
+        )
+    """)
     
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Основная таблица
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS personas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                owner_id INTEGER NOT NULL,
-                name TEXT NOT NULL,
-                age INTEGER NOT NULL,
-                description TEXT NOT NULL,
-                character TEXT,
-                scene TEXT,
-                photo_path TEXT NOT NULL,
-                photo_url TEXT,
-                public BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(owner_id, name)
-            )
-        """)
-        
-        # Безопасное добавление новых колонок (миграции)
-        migrations = [
-            "ALTER TABLE personas ADD COLUMN initial_scene TEXT",
-            "ALTER TABLE personas ADD COLUMN photo_file_id TEXT",
-            "ALTER TABLE personas ADD COLUMN chat_count INTEGER DEFAULT 0"
-        ]
-        
-        for migration in migrations:
-            try:
-                cursor.execute(migration)
-            except sqlite3.OperationalError:
-                # Колонка уже существует, игнорируем ошибку
-                pass
-        
-        # Создание индексов
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_personas_owner_id ON personas(owner_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_personas_public ON personas(public)")
-        
-        logger.info("База данных personas.db успешно инициализирована")
+    # Безопасное добавление новых колонок (миграции): один PRAGMA вместо
+    # трех ALTER, которые SQLite разбирает и отклоняет на каждом старте
+    migrations = [
+        ("initial_scene", "ALTER TABLE personas ADD COLUMN initial_scene TEXT"),
+        ("photo_file_id", "ALTER TABLE personas ADD COLUMN photo_file_id TEXT"),
+        ("chat_count", "ALTER TABLE personas ADD COLUMN chat_count INTEGER DEFAULT 0"),
+    ]
+
+    existing_columns = {row[1] for row in cursor.execute("PRAGMA table_info(personas)")}
+    for column, migration in migrations:
+        if column not in existing_columns:
+            cursor.execute(migration)
+    
+    # Создание индексов
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_personas_owner_id ON personas(owner_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_personas_public ON personas(public)")
+    # Покрывающий индекс под ORDER BY name в get_personas_by_owner
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_personas_owner_name ON personas(owner_id, name)")
+    # Частичный индекс под get_public_personas (фильтр public=1 + сортировка)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_personas_public_order
+        ON personas(chat_count DESC, name ASC) WHERE public = 1
+    """)
+    # Обновляем статистику планировщика запросов
+    cursor.execute("PRAGMA optimize")
+
+    logger.info("База данных personas.db успешно инициализирована")
+
+    conn.commit()
 
 
 # ==========================================
@@ -264,10 +425,6 @@ def create_persona(
     public: bool = False,
 ) -> int:
     """Создает нового персонажа."""
-    # Убедимся, что БД инициализирована (быстрая проверка)
-    if not _pool_initialized:
-        init_database()
-
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
@@ -291,12 +448,40 @@ def create_persona(
         return persona_id
 
 
+def bulk_create_personas(rows: List[tuple]) -> int:
+    """
+    Вставляет несколько персонажей одной транзакцией (один fsync на пачку).
+    rows — кортежи (owner_id, name, age, description, character, scene,
+    initial_scene, photo_path, photo_url, public).
+    """
+    if not rows:
+        return 0
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.executemany("""
+            INSERT INTO personas
+            (owner_id, name, age, description, character, scene, initial_scene, photo_path, photo_url, public)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        logger.info(f"Создано персонажей пачкой: {len(rows)}")
+        return len(rows)
+
+
+def check_name_available(owner_id: int, name: str) -> bool:
+    """Проверяет, свободно ли имя персонажа у данного владельца."""
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT 1 FROM personas WHERE owner_id = ? AND name = ? LIMIT 1",
+            (owner_id, name),
+        )
+        return cursor.fetchone() is None
+
+
 def get_persona_by_id(persona_id: int) -> Optional[Dict[str, Any]]:
     """Получает данные персонажа по ID."""
-    if not _pool_initialized:
-        init_database()
-
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM personas WHERE id = ?", (persona_id,))
         row = cursor.fetchone()
@@ -310,10 +495,7 @@ def get_personas_by_owner(owner_id: int, include_public: bool = True) -> List[Di
     Возвращает список персонажей.
     Если include_public=True, возвращает своих + публичных.
     """
-    if not _pool_initialized:
-        init_database()
-
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         cursor = conn.cursor()
         
         if include_public:
@@ -350,9 +532,6 @@ def update_persona(
     public: Optional[bool] = None,
 ) -> bool:
     """Обновляет данные существующего персонажа."""
-    if not _pool_initialized:
-        init_database()
-
     updates = []
     params = []
     reset_file_id = False
@@ -412,9 +591,6 @@ def update_persona(
 
 def delete_persona(persona_id: int) -> bool:
     """Удаляет персонажа."""
-    if not _pool_initialized:
-        init_database()
-
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM personas WHERE id = ?", (persona_id,))
@@ -423,9 +599,6 @@ def delete_persona(persona_id: int) -> bool:
 
 def increment_persona_chat_count(persona_id: int) -> bool:
     """Увеличивает счетчик использований персонажа (популярность)."""
-    if not _pool_initialized:
-        init_database()
-        
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
@@ -438,10 +611,7 @@ def increment_persona_chat_count(persona_id: int) -> bool:
 
 def get_public_personas() -> List[Dict[str, Any]]:
     """Возвращает список публичных персонажей, отсортированных по популярности."""
-    if not _pool_initialized:
-        init_database()
-        
-    with get_db_connection() as conn:
+    with get_read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT * FROM personas 
@@ -475,8 +645,15 @@ def persona_to_dict(row: Dict[str, Any]) -> Dict[str, Any]:
         "chat_count": row.get("chat_count", 0)
     }
 
+# Гарантированное закрытие при выходе процесса (идемпотентно; штатная
+# остановка уже вызывает close_all_connections перед выгрузкой в облако)
+atexit.register(close_all_connections)
+
+
 __all__ = [
-    "init_database", 
+    "init_database",
+    "get_read_connection",
+    "get_write_connection",
     "create_persona", 
     "get_persona_by_id", 
     "get_personas_by_owner", 
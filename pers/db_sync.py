@@ -5,6 +5,7 @@
 
 import os
 import logging
+import threading
 from pathlib import Path
 from typing import Optional
 
@@ -18,6 +19,27 @@ PERSONAS_DB = BASE_DIR / "pers" / "personas.db"
 # Пути в облаке
 CLOUD_DB_PREFIX = "databases/"
 
+# Dirty-флаги по именам БД: пулы соединений помечают базу при любой записи
+# (по росту total_changes), а sync_databases_to_cloud пропускает базы без
+# изменений — заливать идентичный файл в облако незачем.
+_dirty_dbs: set[str] = set()
+_dirty_lock = threading.Lock()
+
+
+def mark_db_dirty(db_name: str) -> None:
+    """Помечает БД как измененную с момента последней синхронизации."""
+    with _dirty_lock:
+        _dirty_dbs.add(db_name)
+
+
+def _consume_dirty(db_name: str) -> bool:
+    """Снимает и возвращает dirty-флаг БД."""
+    with _dirty_lock:
+        if db_name in _dirty_dbs:
+            _dirty_dbs.discard(db_name)
+            return True
+        return False
+
 
 def get_s3_client():
     """Создает S3 клиент для Yandex Object Storage."""
@@ -299,17 +321,29 @@ def sync_databases_to_cloud() -> bool:
         True если успешно загружено, False при ошибке
     """
     logger.info("Сохранение БД в облако...")
-    
+
     results = []
-    
-    # Всегда загружаем users.db в облако
-    logger.info("Сохраняю users.db в облако...")
-    results.append(upload_database(USERS_DB, f"{CLOUD_DB_PREFIX}users.db"))
-    
-    # Всегда загружаем personas.db в облако
-    logger.info("Сохраняю personas.db в облако...")
-    results.append(upload_database(PERSONAS_DB, f"{CLOUD_DB_PREFIX}personas.db"))
-    
+
+    # Загружаем только измененные БД: без записей с последней синхронизации
+    # выгрузка была бы no-op и только тратила бы трафик и квоту хранилища.
+    if _consume_dirty("users.db"):
+        logger.info("Сохраняю users.db в облако...")
+        ok = upload_database(USERS_DB, f"{CLOUD_DB_PREFIX}users.db")
+        if not ok:
+            mark_db_dirty("users.db")
+        results.append(ok)
+    else:
+        logger.info("users.db не менялась, пропускаю выгрузку")
+
+    if _consume_dirty("personas.db"):
+        logger.info("Сохраняю personas.db в облако...")
+        ok = upload_database(PERSONAS_DB, f"{CLOUD_DB_PREFIX}personas.db")
+        if not ok:
+            mark_db_dirty("personas.db")
+        results.append(ok)
+    else:
+        logger.info("personas.db не менялась, пропускаю выгрузку")
+
     return all(results)
 
 
@@ -317,3 +351,17 @@ async def sync_databases_to_cloud_async() -> bool:
     """Асинхронная версия загрузки БД в облако."""
     import asyncio
     return await asyncio.to_thread(sync_databases_to_cloud)
+
+
+async def cleanup_temp_files_on_start() -> None:
+    """
+    Фоновая очистка временных файлов в облаке при старте бота.
+    Определена на уровне модуля, чтобы не пересоздавать замыкание в main.
+    """
+    try:
+        from pers.storage import cleanup_temp_files_yandex
+        deleted = await cleanup_temp_files_yandex()
+        if deleted > 0:
+            logger.info(f"Очищено {deleted} временных файлов в облаке при старте")
+    except Exception as e:
+        logger.debug(f"Не удалось очистить временные файлы при старте: {e}")
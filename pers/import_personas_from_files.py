@@ -0,0 +1,108 @@
+"""
+Импорт персонажей из файлов pers/users/<user_id>/<имя>_profile.py в personas.db.
+Пропускает уже существующих персонажей, новые вставляет одной транзакцией.
+
+Запуск вручную: python -m pers.import_personas_from_files
+"""
+
+from __future__ import annotations
+
+import ast
+import importlib.util
+import logging
+from pathlib import Path
+from typing import Optional
+
+from pers.database import init_database, get_personas_by_owner, bulk_create_personas
+
+logger = logging.getLogger(__name__)
+
+USERS_DIR = Path(__file__).parent / "users"
+
+
+def _exec_profile(py_file: Path) -> Optional[dict]:
+    """Загружает словарь профиля, выполняя модуль через importlib (fallback)."""
+    spec = importlib.util.spec_from_file_location(py_file.stem, py_file)
+    if spec is None or spec.loader is None:
+        return None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for attr in dir(module):
+        if attr.startswith("get_"):
+            return getattr(module, attr)()
+    return None
+
+
+def _load_profile(py_file: Path) -> Optional[dict]:
+    """
+    Извлекает словарь профиля из *_profile.py.
+    Профили — это функции get_<имя>, возвращающие dict-литерал, поэтому
+    сначала читаем его через ast.literal_eval: без компиляции в байткод,
+    без создания модуля и без выполнения произвольного кода. Выполнение
+    модуля остается запасным путем для нестандартных файлов.
+    """
+    try:
+        tree = ast.parse(py_file.read_text(encoding="utf-8"))
+        for node in tree.body:
+            if isinstance(node, ast.FunctionDef) and node.name.startswith("get_"):
+                for stmt in ast.walk(node):
+                    if isinstance(stmt, ast.Return) and stmt.value is not None:
+                        return ast.literal_eval(stmt.value)
+    except (SyntaxError, ValueError):
+        pass
+    return _exec_profile(py_file)
+
+
+def import_personas() -> int:
+    """Импортирует все профили; новые персонажи пишутся одной транзакцией."""
+    init_database()
+
+    rows = []
+    for user_dir in sorted(USERS_DIR.iterdir()):
+        if not user_dir.is_dir():
+            continue
+        try:
+            user_id = int(user_dir.name)
+        except ValueError:
+            continue
+
+        # Один запрос и set-поиск вместо сканирования списка на каждый файл
+        existing_names = {p["name"] for p in get_personas_by_owner(user_id, include_public=False)}
+        for py_file in sorted(user_dir.glob("*_profile.py")):
+            try:
+                profile = _load_profile(py_file)
+            except Exception as e:
+                logger.error(f"Ошибка загрузки {py_file}: {e}")
+                continue
+            if not profile:
+                continue
+
+            name = profile.get("name")
+            if not name:
+                continue
+            if name in existing_names:
+                logger.info(f"Персонаж «{name}» у пользователя {user_id} уже есть, пропускаю")
+                continue
+
+            existing_names.add(name)  # Защита от дублей в рамках одного импорта
+            rows.append((
+                user_id,
+                name,
+                profile.get("age", 18),
+                profile.get("description", ""),
+                profile.get("character"),
+                profile.get("scene"),
+                profile.get("initial_scene"),
+                profile.get("photo", ""),
+                profile.get("photo_url"),
+                0,
+            ))
+
+    created = bulk_create_personas(rows)
+    logger.info(f"Импортировано персонажей: {created}")
+    return created
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    import_personas()
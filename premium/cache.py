@@ -0,0 +1,80 @@
+"""
+Кэш премиум-статуса пользователей с коротким TTL.
+Профиль и запуск чата раньше делали до четырех отдельных обращений к БД
+(is_premium, get_premium_expiry, get_premium_status, is_premium_unlimited) —
+теперь вся информация собирается одним запросом и кэшируется.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from .subscription import PREMIUM_PLANS, get_premium_status, is_premium
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = 60  # Время жизни кэша в секундах (1 минута)
+
+
+@dataclass
+class PremiumInfo:
+    """Сводный премиум-статус пользователя."""
+    active: bool
+    unlimited: bool
+    expiry: Optional[datetime]
+    status: Optional[dict]
+
+
+# user_id -> (info, timestamp)
+_cache: Dict[int, Tuple[PremiumInfo, float]] = {}
+
+
+def _parse_expiry(status: Optional[dict]) -> Optional[datetime]:
+    """Разбирает дату окончания подписки из статуса (как get_premium_expiry)."""
+    if not status or not status.get("expires_at"):
+        return None
+    try:
+        expires_at = datetime.fromisoformat(status["expires_at"].replace("Z", "+00:00"))
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=datetime.now().tzinfo)
+        return expires_at
+    except Exception as e:
+        logger.error(f"Ошибка при парсинге даты окончания подписки: {e}")
+        return None
+
+
+def get_premium_info(user_id: int) -> PremiumInfo:
+    """
+    Возвращает премиум-статус пользователя одним объектом.
+    Результат кэшируется на CACHE_TTL секунд, чтобы открытие профиля
+    не ходило в БД четыре раза подряд.
+    """
+    now = time.time()
+    cached = _cache.get(user_id)
+    if cached is not None and (now - cached[1]) < CACHE_TTL:
+        return cached[0]
+
+    try:
+        active = is_premium(user_id)
+        status = get_premium_status(user_id) if active else None
+        expiry = _parse_expiry(status)
+        unlimited = False
+        if active and status:
+            plan = PREMIUM_PLANS.get(status.get("plan_type", 1))
+            unlimited = bool(plan and plan.get("unlimited", False))
+        info = PremiumInfo(active=active, unlimited=unlimited, expiry=expiry, status=status)
+    except Exception as e:
+        logger.error(f"Ошибка при проверке премиум статуса для user_id={user_id}: {e}", exc_info=True)
+        info = PremiumInfo(active=False, unlimited=False, expiry=None, status=None)
+
+    _cache[user_id] = (info, now)
+    return info
+
+
+def invalidate_premium(user_id: int) -> None:
+    """Сбрасывает кэш премиум-статуса (вызывать при изменении подписки)."""
+    _cache.pop(user_id, None)
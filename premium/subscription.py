@@ -80,6 +80,20 @@ def init_premium_database() -> None:
         logger.info("Таблица premium_subscriptions инициализирована")
 
 
+def _invalidate_premium_caches(user_id: int) -> None:
+    """Сбрасывает кэши премиум-статуса, чтобы изменение подписки было видно сразу."""
+    try:
+        from premium.cache import invalidate_premium
+        invalidate_premium(user_id)
+    except Exception:
+        pass
+    try:
+        from features.my_chars._premium_cache import invalidate_premium as _inv
+        _inv(user_id)
+    except Exception:
+        pass
+
+
 def is_premium(user_id: int) -> bool:
     """
     Проверяет, есть ли у пользователя активная премиум подписка.
@@ -252,7 +266,10 @@ def activate_premium(user_id: int, plan_type: int) -> bool:
             logger.info(f"Начислено {tokens_to_add} токенов на баланс для user_id={user_id}")
         except Exception as e:
             logger.error(f"Не удалось начислить токены премиум пользователю {user_id}: {e}")
-    
+
+    if success:
+        _invalidate_premium_caches(user_id)
+
     return success
 
 
@@ -280,7 +297,8 @@ def deactivate_premium(user_id: int) -> bool:
         
         if affected > 0:
             logger.info(f"Премиум подписка деактивирована для user_id={user_id}")
-        
+            _invalidate_premium_caches(user_id)
+
         return affected > 0
 
 